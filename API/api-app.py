@@ -1,39 +1,98 @@
-import pandas as pd
-import numpy as np
-import uvicorn
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import RedirectResponse
-from pydantic import BaseModel, constr, conint
-import joblib
-from sklearn.preprocessing import OneHotEncoder, StandardScaler
-from sklearn.compose import ColumnTransformer
-from sklearn.pipeline import Pipeline
-import pickle
-
-# Define the names of input features
-input_features = ['model_key', 'mileage', 'engine_power', 'fuel', 'paint_color',
-                  'car_type', 'private_parking_available', 'has_gps',
-                  'has_air_conditioning', 'automatic_car', 'has_getaround_connect',
-                  'has_speed_regulator', 'winter_tires']
-
-# Define numeric and categorical features based on input_features
-numeric_features = ['mileage', 'engine_power']
-categorical_features = [feature for feature in input_features if feature not in numeric_features]
-
-class RentalPredictionFeatures(BaseModel):
-    model_key: constr(min_length=1, regex='^(Citroën|Peugeot|PGO|Renault|Audi|BMW|Ford|Mercedes|Opel|Porsche|Volkswagen|KIA Motors|Alfa Romeo|Ferrari|Fiat|Lamborghini|Maserati|Lexus|Honda|Mazda|Mini|Mitsubishi|Nissan|SEAT|Subaru|Suzuki|Toyota|Yamaha)$')
-    mileage: conint(ge=0, le=300000)
-    engine_power: conint(ge=0, le=300)
-    fuel: constr(regex='^(diesel|petrol|hybrid_petrol|electro)$')
-    paint_color: constr(regex='^(black|grey|white|red|silver|blue|orange|beige|brown|green)$')
-    car_type: constr(regex='^(convertible|coupe|estate|hatchback|sedan|subcompact|suv|van)$')
-    private_parking_available: bool
-    has_gps: bool
-    has_air_conditioning: bool
-    automatic_car: bool
-    has_getaround_connect: bool
-    has_speed_regulator: bool
-    winter_tires: bool
+from model_loading import StartupTimer
+
+# Measure how long each step of the startup takes, starting with the imports
+startup_timer = StartupTimer()
+
+with startup_timer.step('imports'):
+    import asyncio
+    import hmac
+    import os
+    import time
+    import logging
+    from concurrent.futures import ThreadPoolExecutor
+    from functools import partial
+    from typing import Optional
+    import uvicorn
+    from fastapi import FastAPI, HTTPException, Request
+    from fastapi.responses import PlainTextResponse, RedirectResponse
+    from pydantic import BaseModel, Field, ValidationError, root_validator
+    from features import input_features
+    from schemas import RowValidator, make_features_model
+    from fast_json import ResponseClass, RouteClass
+    from model_registry import ModelRegistry
+    from scheduler import MicroBatchScheduler
+    from prediction_cache import PredictionCache
+    from metrics import (PayloadSampler, RequestStartMiddleware, StageTimings,
+                         format_histogram, format_metric)
+
+# Maximum number of cars accepted in one call to the batch endpoint
+MAX_BATCH_SIZE = int(os.environ.get('MAX_BATCH_SIZE', 50000))
+# Threads validating and predicting the batch requests, apart from the micro-batches of /predictions
+BATCH_PREDICTION_THREADS = int(os.environ.get('BATCH_PREDICTION_THREADS', 1))
+
+# Micro-batching of concurrent /predictions requests
+MICRO_BATCH_MAX_SIZE = int(os.environ.get('MICRO_BATCH_MAX_SIZE', 32))
+MICRO_BATCH_MAX_WAIT_MS = float(os.environ.get('MICRO_BATCH_MAX_WAIT_MS', 2))
+PREDICTION_THREADS = int(os.environ.get('PREDICTION_THREADS', 1))
+# Number of threads used by XGBoost inside each prediction call
+MODEL_THREADS = int(os.environ.get('MODEL_THREADS', 1))
+
+# 'auto' serves batches of up to TREE_ENSEMBLE_MAX_ROWS cars from the exported tree ensemble
+# (best_model.npz) when it is available, 'xgboost' always uses the XGBoost model.
+# The tree ensemble stops being faster than XGBoost at about 16 cars with the current model.
+INFERENCE_BACKEND = os.environ.get('INFERENCE_BACKEND', 'auto')
+TREE_ENSEMBLE_MAX_ROWS = int(os.environ.get('TREE_ENSEMBLE_MAX_ROWS', 16))
+
+# Prediction cache (a size of 0 disables it, a mileage bucket of 0 disables mileage bucketing)
+PREDICTION_CACHE_SIZE = int(os.environ.get('PREDICTION_CACHE_SIZE', 10000))
+PREDICTION_CACHE_TTL = float(os.environ.get('PREDICTION_CACHE_TTL', 3600))
+MILEAGE_BUCKET = int(os.environ.get('MILEAGE_BUCKET', 0))
+
+# Share of the prediction payloads written to the logs (between 0 and 1)
+PAYLOAD_LOG_SAMPLE_RATE = float(os.environ.get('PAYLOAD_LOG_SAMPLE_RATE', 0.01))
+
+# Directory of the versioned model bundles (see model_registry.py), re-read every MODEL_REGISTRY_POLL_SECONDS
+# (0 disables it). The /models/active and /models/candidate endpoints need the MODEL_ADMIN_TOKEN in X-Admin-Token.
+MODEL_REGISTRY_DIR = os.environ.get('MODEL_REGISTRY_DIR', 'models')
+MODEL_REGISTRY_POLL_SECONDS = float(os.environ.get('MODEL_REGISTRY_POLL_SECONDS', 10))
+MODEL_ADMIN_TOKEN = os.environ.get('MODEL_ADMIN_TOKEN', '')
+
+class BatchPredictionRequest(BaseModel):
+    # Either a list of cars (one dict per car) or a columnar payload (one list per feature).
+    # The cars are not typed here: pydantic would check every element on the event loop,
+    # they are validated one by one (with per-row errors) in the batch thread pool instead.
+    rows: Optional[list] = None
+    columns: Optional[dict] = None
+
+    @root_validator(skip_on_failure=True)
+    def check_payload(cls, values):
+        rows, columns = values.get('rows'), values.get('columns')
+        if (rows is None) == (columns is None):
+            raise ValueError("provide exactly one of 'rows' or 'columns'")
+        if columns is not None:
+            if not all(isinstance(column, list) for column in columns.values()):
+                raise ValueError("all values of 'columns' must be lists")
+            if len({len(column) for column in columns.values()}) > 1:
+                raise ValueError("all lists in 'columns' must have the same length")
+        return values
+
+    def __len__(self):
+        if self.rows is not None:
+            return len(self.rows)
+        return len(next(iter(self.columns.values()), []))
+
+    def to_rows(self):
+        """Returns the payload as a list of dicts, one per car, in input order"""
+        if self.rows is not None:
+            return self.rows
+        names = list(self.columns)
+        return [dict(zip(names, values)) for values in zip(*self.columns.values())]
+
+class ModelVersionRequest(BaseModel):
+    # Version to serve, None to remove the candidate
+    version: Optional[str] = None
+    # Share of the requests also predicted by the candidate version, in the background
+    traffic: float = Field(0.0, ge=0.0, le=1.0)
 
 description = """
 Welcome to this Getaround API ! Dear car owner, here you can get a suggested optimum price for rental.
@@ -50,6 +109,14 @@ tag_metadata = [
         "name": "Predictions",
         "description": "Post some data and get predictions in exchange !"
     },
+    {
+        "name": "Monitoring",
+        "description": "Internal statistics of the API"
+    },
+    {
+        "name": "Models",
+        "description": "Change the model versions served by the API"
+    },
 ]
 
 app = FastAPI(
@@ -60,15 +127,101 @@ app = FastAPI(
         "name": "Caroline Mathius",
         "url": "https://github.com/carolinemathius",
     },
-    openapi_tags=tag_metadata
+    openapi_tags=tag_metadata,
+    default_response_class=ResponseClass,
+)
+# Decode request bodies with orjson when it is available
+app.router.route_class = RouteClass
+app.add_middleware(RequestStartMiddleware)
+
+logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO'), format='%(asctime)s %(levelname)s %(name)s %(message)s')
+logger = logging.getLogger("getaround.api")
+
+# Per-stage latency histograms for each prediction endpoint, and sampled payload logging
+STAGES = ['validation', 'build', 'transform', 'predict', 'serialize']
+stage_timings = {
+    "predictions": StageTimings(STAGES),
+    "predictions_batch": StageTimings(STAGES),
+}
+payload_sampler = PayloadSampler(PAYLOAD_LOG_SAMPLE_RATE, logger)
+
+def observe_validation(timings, request):
+    """Time spent between the arrival of the request and the endpoint (body decoding and validation)"""
+    request_start = getattr(request.state, 'request_start', None)
+    if request_start is not None:
+        timings.observe('validation', time.perf_counter() - request_start)
+
+# Cache of predictions, keyed on the model version and emptied when the active version changes
+prediction_cache = PredictionCache(
+    input_features,
+    max_size=PREDICTION_CACHE_SIZE,
+    ttl_seconds=PREDICTION_CACHE_TTL,
+    mileage_bucket=MILEAGE_BUCKET,
+)
+
+# Load the model versions set in the registry (best_model.pkl and preprocessor.pkl without one).
+# Each version is checked and warmed up before it serves anything, and cached predictions
+# are dropped when the active version changes.
+model_registry = ModelRegistry(
+    MODEL_REGISTRY_DIR,
+    on_swap=lambda previous, bundle: prediction_cache.clear(),
+    model_threads=MODEL_THREADS,
+    inference_backend=INFERENCE_BACKEND,
+    tree_ensemble_max_rows=TREE_ENSEMBLE_MAX_ROWS,
+)
+model_registry.sync(timer=startup_timer)
+
+# The accepted values of the categorical features are the ones the encoder was fitted on
+RentalPredictionFeatures = make_features_model(model_registry.active.categories)
+row_validator = RowValidator(RentalPredictionFeatures, model_registry.active.categories)
+
+def predict_rows(rows, timings):
+    """Predicts the rental price of a list of cars (dicts) with the active model version"""
+    return model_registry.active.predict_rows(rows, timings)
+
+def cache_key_of(input_data):
+    """Cache key of a normalized car, specific to the active model version"""
+    return (model_registry.active.version, prediction_cache.key(input_data))
+
+# Group concurrent requests into small batches that run outside of the event loop
+scheduler = MicroBatchScheduler(
+    partial(predict_rows, timings=stage_timings["predictions"]),
+    max_batch_size=MICRO_BATCH_MAX_SIZE,
+    max_wait_ms=MICRO_BATCH_MAX_WAIT_MS,
+    n_threads=PREDICTION_THREADS,
 )
 
-# Load trained model
-model = joblib.load("best_model.pkl")
+# Follow the changes of the registry in each worker
+async def follow_model_registry():
+    while True:
+        await asyncio.sleep(MODEL_REGISTRY_POLL_SECONDS)
+        try:
+            await asyncio.to_thread(model_registry.sync)
+        except Exception:
+            logger.exception("Could not serve the model versions set in %s", model_registry.config_path)
+
+# The model is loaded at import time (once in the gunicorn master with preload_app),
+# each worker is ready once its own scheduler is running
+app.state.ready = False
 
-# Load the preprocessor
-with open('preprocessor.pkl', 'rb') as file:
-    preprocessor = pickle.load(file)
+@app.on_event("startup")
+async def start_scheduler():
+    with startup_timer.step('start_scheduler'):
+        await scheduler.start()
+        app.state.batch_executor = ThreadPoolExecutor(max_workers=BATCH_PREDICTION_THREADS,
+                                                      thread_name_prefix='batch_prediction')
+    app.state.registry_follower = None
+    if MODEL_REGISTRY_POLL_SECONDS > 0:
+        app.state.registry_follower = asyncio.create_task(follow_model_registry())
+    app.state.ready = True
+
+@app.on_event("shutdown")
+async def stop_scheduler():
+    app.state.ready = False
+    if app.state.registry_follower is not None:
+        app.state.registry_follower.cancel()
+    await scheduler.stop()
+    app.state.batch_executor.shutdown(wait=True)
 
 # Define the FastAPI endpoints
 @app.get("/", tags=["Introduction Endpoint"])
@@ -77,46 +230,186 @@ async def docs_redirect():
     return RedirectResponse(url='/docs')
 
 @app.post("/predictions", tags=["Predictions"])
-async def predict(prfeatures: RentalPredictionFeatures):
+async def predict(prfeatures: RentalPredictionFeatures, request: Request):
+    timings = stage_timings["predictions"]
+    observe_validation(timings, request)
     try:
         # Convert input data to a dictionary for prediction
-        input_data = {
-            "model_key": [prfeatures.model_key],
-            "mileage": [prfeatures.mileage],
-            "engine_power": [prfeatures.engine_power],
-            "fuel": [prfeatures.fuel],
-            "paint_color": [prfeatures.paint_color],
-            "car_type": [prfeatures.car_type],
-            "private_parking_available": [prfeatures.private_parking_available],
-            "has_gps": [prfeatures.has_gps],
-            "has_air_conditioning": [prfeatures.has_air_conditioning],
-            "automatic_car": [prfeatures.automatic_car],
-            "has_getaround_connect": [prfeatures.has_getaround_connect],
-            "has_speed_regulator": [prfeatures.has_speed_regulator],
-            "winter_tires": [prfeatures.winter_tires],
-        }
-
-        # Create a DataFrame from the input data with the defined feature names
-        input_df = pd.DataFrame(input_data, columns=input_features)
-        print("Performing preprocessings...")
-        print(input_df.head())
-        print()
-
-        # Preprocess the input data using the loaded preprocessor
-        preprocessed_data = preprocessor.transform(input_df)
-        print('...Done.')
-        print(preprocessed_data[0:5])
-        
-        # Perform the prediction
-        prediction = model.predict(preprocessed_data)
+        with timings.time('build'):
+            input_data = prediction_cache.normalize(prfeatures.dict())
+            cache_key = cache_key_of(input_data)
+        prediction = prediction_cache.get(cache_key)
+
+        if prediction is None:
+            # Queue the car, it is predicted together with the other concurrent requests
+            prediction = await scheduler.submit(input_data)
+            prediction_cache.put(cache_key, prediction)
+
+            # Compare a share of the predictions with the candidate model version, in the background
+            if model_registry.should_shadow():
+                model_registry.submit_shadow([input_data], [prediction])
+
+        payload_sampler.maybe_log("prediction", features=input_data, prediction=prediction)
 
         # Return the prediction or any other response
-        return {"prediction": prediction.tolist()}  # Convert prediction to a list
+        with timings.time('serialize'):
+            return ResponseClass({"prediction": [prediction]})
 
-    except Exception as e:
+    except Exception:
         # Capture and log the exception details
-        print(str(e))
+        logger.exception("Prediction failed")
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+def predict_batch_rows(batch, timings, validation_start):
+    """Validates each car on its own so that one bad row does not reject the whole batch,
+    and only sends to the model the cars that are not already cached. Runs in the batch thread pool."""
+    rows = batch.to_rows()
+    predictions = [None] * len(rows)
+    rows_to_predict, positions_to_predict, cache_keys, errors = [], [], [], []
+    valid_features = []
+    for position, row in enumerate(rows):
+        try:
+            valid_features.append((position, row_validator.validate(row)))
+        except ValidationError as e:
+            errors.append({"index": position, "detail": e.errors()})
+    timings.observe('validation', time.perf_counter() - validation_start)
+
+    with timings.time('build'):
+        for position, features in valid_features:
+            input_data = prediction_cache.normalize(features)
+            cache_key = cache_key_of(input_data)
+            predictions[position] = prediction_cache.get(cache_key)
+            if predictions[position] is None:
+                rows_to_predict.append(input_data)
+                positions_to_predict.append(position)
+                cache_keys.append(cache_key)
+
+    batch_predictions = predict_rows(rows_to_predict, timings) if rows_to_predict else []
+    for position, cache_key, prediction in zip(positions_to_predict, cache_keys, batch_predictions):
+        predictions[position] = prediction
+        prediction_cache.put(cache_key, prediction)
+    return predictions, errors, rows_to_predict, batch_predictions
+
+@app.post("/predictions/batch", tags=["Predictions"])
+async def predict_batch(batch: BatchPredictionRequest, request: Request):
+    """Predicts rental prices for many cars with a single preprocessing and prediction call.
+    Predictions come back in input order, invalid cars get a null prediction and are listed in errors."""
+    timings = stage_timings["predictions_batch"]
+    # One validation sample per request: body decoding and validation, then the validation of each car
+    validation_start = getattr(request.state, 'request_start', None) or time.perf_counter()
+    if len(batch) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=413, detail=f"Batch size {len(batch)} exceeds the maximum of {MAX_BATCH_SIZE}")
+
+    try:
+        predictions, errors, rows_to_predict, batch_predictions = await asyncio.get_running_loop().run_in_executor(
+            app.state.batch_executor, predict_batch_rows, batch, timings, validation_start
+        )
+    except Exception:
+        logger.exception("Batch prediction failed")
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+    if rows_to_predict and model_registry.should_shadow():
+        model_registry.submit_shadow(rows_to_predict, batch_predictions)
+
+    payload_sampler.maybe_log("batch_prediction", n_rows=len(batch), n_errors=len(errors),
+                              n_predicted=len(rows_to_predict))
+
+    with timings.time('serialize'):
+        return ResponseClass({"predictions": predictions, "errors": errors})
+
+@app.get("/ready", tags=["Monitoring"])
+async def ready():
+    """Readiness probe: 200 once the model is loaded and the worker accepts predictions, 503 before"""
+    if not app.state.ready:
+        return ResponseClass({"ready": False}, status_code=503)
+    active = model_registry.active
+    return {"ready": True, "version": active.version, "model": active.model_loaded_from,
+            "tree_ensemble": active.tree_ensemble is not None}
+
+@app.get("/startup", tags=["Monitoring"])
+async def startup_breakdown():
+    """Time spent in each step of the startup (imports, model loading, preprocessor compilation...)"""
+    return {"model": model_registry.active.model_loaded_from, **startup_timer.breakdown()}
+
+@app.get("/scheduler/stats", tags=["Monitoring"])
+async def scheduler_stats():
+    """Current queue depth and histograms of micro-batch sizes and queue depths"""
+    return scheduler.stats()
+
+@app.get("/cache/stats", tags=["Monitoring"])
+async def cache_stats():
+    """Size and hit/miss counters of the prediction cache"""
+    return prediction_cache.stats()
+
+@app.get("/models", tags=["Monitoring"])
+async def models():
+    """Active and candidate model versions, their prediction latencies and the shadow traffic comparison"""
+    return model_registry.stats()
+
+def check_admin_token(request):
+    if not MODEL_ADMIN_TOKEN or not hmac.compare_digest(request.headers.get('X-Admin-Token', ''), MODEL_ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="A valid X-Admin-Token header is required")
+
+async def change_model_versions(change, *args):
+    """Loads the new versions in this worker (outside of the event loop) and publishes them to the others"""
+    try:
+        await asyncio.to_thread(change, *args)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e.args[0]))
+    except (ValueError, FileNotFoundError) as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except Exception:
+        logger.exception("Could not change the model versions")
         raise HTTPException(status_code=500, detail="Internal Server Error")
+    return model_registry.stats()
+
+@app.post("/models/active", tags=["Models"])
+async def activate_model(change: ModelVersionRequest, request: Request):
+    """Serves another model version, once it is loaded and warmed up. In-flight requests finish on the previous one."""
+    check_admin_token(request)
+    if change.version is None:
+        raise HTTPException(status_code=422, detail="version is required")
+    return await change_model_versions(model_registry.activate, change.version)
+
+@app.post("/models/candidate", tags=["Models"])
+async def set_candidate_model(change: ModelVersionRequest, request: Request):
+    """Also predicts a share (traffic) of the requests with a candidate version, in the background,
+    to compare its latency and predictions with the active version. A null version removes the candidate."""
+    check_admin_token(request)
+    return await change_model_versions(model_registry.set_candidate, change.version, change.traffic)
+
+@app.get("/metrics", tags=["Monitoring"], response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus-style metrics: per-stage latencies, micro-batching and prediction cache"""
+    lines = format_histogram(
+        "prediction_stage_duration_seconds",
+        "Time spent in each stage of the prediction endpoints",
+        [({"endpoint": endpoint, "stage": stage}, snapshot)
+         for endpoint, timings in stage_timings.items()
+         for stage, snapshot in timings.snapshot().items()],
+    )
+    scheduler_stats = scheduler.stats()
+    lines += format_metric("scheduler_queue_depth", "Requests waiting to be batched", "gauge",
+                           scheduler_stats["queue_depth"])
+    lines += format_histogram("scheduler_batch_size", "Number of requests per micro-batch",
+                              [({}, scheduler_stats["batch_size"])])
+    lines += format_histogram("scheduler_queue_depth_at_submit", "Queue depth seen by incoming requests",
+                              [({}, scheduler_stats["queue_depth_at_submit"])])
+    lines += ["# HELP startup_step_seconds Time spent in each step of the startup",
+              "# TYPE startup_step_seconds gauge"]
+    lines += [f'startup_step_seconds{{step="{step}"}} {seconds}' for step, seconds in startup_timer.steps.items()]
+    model_bundles = [("active", model_registry.active), ("candidate", model_registry.candidate)]
+    lines += format_histogram("model_predict_duration_seconds", "Time spent predicting a batch with each model version",
+                              [({"role": role, "version": bundle.version}, bundle.predict_latency.snapshot())
+                               for role, bundle in model_bundles if bundle is not None])
+    lines += format_metric("model_registry_swaps_total", "Changes of the active model version", "counter",
+                           model_registry.swaps)
+    cache_stats = prediction_cache.stats()
+    lines += format_metric("prediction_cache_size", "Entries in the prediction cache", "gauge", cache_stats["size"])
+    for counter in ["hits", "misses", "evictions", "expirations", "invalidations"]:
+        lines += format_metric(f"prediction_cache_{counter}_total", f"Prediction cache {counter}", "counter",
+                               cache_stats[counter])
+    return PlainTextResponse("\n".join(lines) + "\n")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,257 @@
+"""
+Load test and latency benchmark for the pricing API.
+
+Generates realistic cars from the categories known by the preprocessor, sends them to the API
+at a given concurrency and reports throughput and p50/p95/p99 latencies for three scenarios:
+  - single: one car per /predictions request, every car different (cache misses)
+  - batch:  several cars per /predictions/batch request
+  - cached: one car per /predictions request, drawn from a small pool of cars already cached
+
+The API is either run in-process (default) or reached over HTTP with --url.
+Each scenario is run --repeats times and reported with the median of each statistic over the runs,
+which is what a previous run is compared with: a single run varies too much from one to the next.
+Results are saved as JSON and can be compared with a previous run to catch regressions.
+
+Usage (from the API directory, needs `pip install httpx`):
+    python benchmark.py --requests 2000 --concurrency 32 --output results.json
+    python benchmark.py --url http://localhost:8000 --baseline results.json
+"""
+import argparse
+import asyncio
+import importlib.util
+import json
+import logging
+import platform
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+import httpx
+import numpy as np
+from compiled_preprocessor import CompiledPreprocessor
+from features import input_features
+from model_loading import file_sha256, load_preprocessor
+
+SCENARIOS = ['single', 'batch', 'cached']
+
+
+class PayloadGenerator:
+    """Random cars using the categories fitted by the preprocessor and the API's numeric ranges"""
+
+    def __init__(self, preprocessor_path='preprocessor.pkl', seed=0):
+        compiled_preprocessor = CompiledPreprocessor(load_preprocessor(preprocessor_path), input_features)
+        self.categories = compiled_preprocessor.categories
+        self.random = random.Random(seed)
+
+    def car(self):
+        car = {feature: self.random.choice(categories) for feature, categories in self.categories.items()}
+        # Mileage and engine power roughly follow the distribution of the training data
+        car['mileage'] = int(min(max(self.random.gauss(140000, 60000), 0), 300000))
+        car['engine_power'] = int(min(max(self.random.gauss(128, 38), 0), 300))
+        return {feature: car[feature] for feature in input_features}
+
+    def cars(self, n):
+        return [self.car() for _ in range(n)]
+
+
+def load_app():
+    """Imports api-app.py (its name is not a valid module name)"""
+    spec = importlib.util.spec_from_file_location("api_app", "api-app.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.app
+
+
+async def run_requests(client, requests, concurrency):
+    """Sends (path, json) requests with at most `concurrency` in flight.
+    Returns the latency of each request in seconds and the total wall time."""
+    latencies = []
+    queue = asyncio.Queue()
+    for request in requests:
+        queue.put_nowait(request)
+
+    async def worker():
+        while not queue.empty():
+            path, payload = queue.get_nowait()
+            start = time.perf_counter()
+            response = await client.post(path, json=payload)
+            latencies.append(time.perf_counter() - start)
+            response.raise_for_status()
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return latencies, time.perf_counter() - start
+
+
+def summarize(latencies, wall_time, cars_per_request):
+    latencies_ms = np.asarray(latencies) * 1000
+    return {
+        "requests": len(latencies),
+        "cars": len(latencies) * cars_per_request,
+        "wall_time_seconds": wall_time,
+        "requests_per_second": len(latencies) / wall_time,
+        "cars_per_second": len(latencies) * cars_per_request / wall_time,
+        "latency_ms": {
+            "mean": float(latencies_ms.mean()),
+            "p50": float(np.percentile(latencies_ms, 50)),
+            "p95": float(np.percentile(latencies_ms, 95)),
+            "p99": float(np.percentile(latencies_ms, 99)),
+            "max": float(latencies_ms.max()),
+        },
+    }
+
+
+def median_summary(runs):
+    """Median of each statistic over repeated runs of a scenario, with the runs themselves"""
+    def median(values):
+        return float(np.median(values))
+    return {
+        "repeats": len(runs),
+        "requests": runs[0]["requests"],
+        "cars": runs[0]["cars"],
+        "wall_time_seconds": median([run["wall_time_seconds"] for run in runs]),
+        "requests_per_second": median([run["requests_per_second"] for run in runs]),
+        "cars_per_second": median([run["cars_per_second"] for run in runs]),
+        "latency_ms": {name: median([run["latency_ms"][name] for run in runs]) for name in runs[0]["latency_ms"]},
+        "runs": runs,
+    }
+
+
+async def run_scenario(client, scenario, generator, n_requests, concurrency, batch_size, cache_pool_size, repeats=1):
+    if scenario == 'single':
+        def make_requests(n):
+            return [("/predictions", car) for car in generator.cars(n)]
+        cars_per_request = 1
+    elif scenario == 'batch':
+        def make_requests(n):
+            return [("/predictions/batch", {"rows": generator.cars(batch_size)}) for _ in range(n)]
+        cars_per_request = batch_size
+    else:
+        pool = generator.cars(cache_pool_size)
+        # Warm the cache first so that the measured requests are all hits
+        await run_requests(client, [("/predictions", car) for car in pool], concurrency)
+
+        def make_requests(n):
+            return [("/predictions", generator.random.choice(pool)) for _ in range(n)]
+        cars_per_request = 1
+
+    # A few untimed requests so that the first measured ones do not pay for warm-up
+    await run_requests(client, make_requests(10), 1)
+    runs = []
+    for _ in range(repeats):
+        latencies, wall_time = await run_requests(client, make_requests(n_requests), concurrency)
+        runs.append(summarize(latencies, wall_time, cars_per_request))
+    return median_summary(runs)
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "git_commit": commit or None,
+        "model_sha256": file_sha256('best_model.pkl'),
+        "preprocessor_sha256": file_sha256('preprocessor.pkl'),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+    }
+
+
+def compare(results, baseline, max_regression):
+    """Prints the change of each scenario against a baseline run, returns the regressed scenarios.
+    Only the median throughput and p50 latency are checked, the p99 of a few runs is too noisy for it."""
+    regressions = []
+    for scenario, result in results["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(scenario)
+        if previous is None:
+            continue
+        throughput_change = result["cars_per_second"] / previous["cars_per_second"] - 1
+        p50_change = result["latency_ms"]["p50"] / previous["latency_ms"]["p50"] - 1
+        p99_change = result["latency_ms"]["p99"] / previous["latency_ms"]["p99"] - 1
+        print(f"{scenario:>8}: throughput {throughput_change:+.1%}, p50 latency {p50_change:+.1%}"
+              f" (p99 latency {p99_change:+.1%})")
+        if throughput_change < -max_regression or p50_change > max_regression:
+            regressions.append(scenario)
+    return regressions
+
+
+async def main_async(args):
+    generator = PayloadGenerator(seed=args.seed)
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url, timeout=60)
+        app = None
+    else:
+        app = load_app()
+        await app.router.startup()
+        client = httpx.AsyncClient(app=app, base_url="http://benchmark", timeout=60)
+
+    results = {
+        "environment": environment(),
+        "config": {
+            "target": args.url or "in-process",
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "batch_size": args.batch_size,
+            "cache_pool_size": args.cache_pool_size,
+            "repeats": args.repeats,
+            "seed": args.seed,
+        },
+        "scenarios": {},
+    }
+    try:
+        for scenario in args.scenarios:
+            result = await run_scenario(client, scenario, generator, args.requests, args.concurrency,
+                                        args.batch_size, args.cache_pool_size, args.repeats)
+            results["scenarios"][scenario] = result
+            latency = result["latency_ms"]
+            print(f"{scenario:>8}: {result['requests_per_second']:8.1f} req/s {result['cars_per_second']:9.1f} cars/s"
+                  f"  p50 {latency['p50']:7.2f} ms  p95 {latency['p95']:7.2f} ms  p99 {latency['p99']:7.2f} ms")
+    finally:
+        await client.aclose()
+        if app is not None:
+            await app.router.shutdown()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the pricing API")
+    parser.add_argument('--url', help="Base URL of a running API (default: run the app in-process)")
+    parser.add_argument('--requests', type=int, default=1000, help="Number of requests per scenario")
+    parser.add_argument('--concurrency', type=int, default=16, help="Number of requests in flight")
+    parser.add_argument('--batch-size', type=int, default=100, help="Number of cars per batch request")
+    parser.add_argument('--cache-pool-size', type=int, default=100, help="Number of distinct cars in the cached scenario")
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument('--repeats', type=int, default=5,
+                        help="Number of runs of each scenario, reported with their median (default 5)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="Where to save the results as JSON")
+    parser.add_argument('--baseline', help="Previous results to compare with")
+    # Identical code measured up to 25% apart from one invocation to the next on a shared machine
+    parser.add_argument('--max-regression', type=float, default=0.3,
+                        help="Allowed drop of the median throughput or increase of the median p50 latency "
+                             "against the baseline (default 30%%, lower it on a dedicated machine)")
+    args = parser.parse_args()
+
+    # Do not log every request sent by the benchmark
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    results = asyncio.run(main_async(args))
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+        print(f"Saved the results to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        regressions = compare(results, baseline, args.max_regression)
+        if regressions:
+            print(f"Performance regression in: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""
+Compiled version of the fitted preprocessor, used to skip pandas and sklearn at inference time.
+
+The fitted ColumnTransformer (StandardScaler on numeric features, OneHotEncoder on categorical
+features) is read once at startup and turned into plain lookup tables: a (mean, scale, column)
+triple per numeric feature and a category -> column index map per categorical feature.
+Cars are then encoded straight into a NumPy buffer.
+"""
+import threading
+import numpy as np
+
+
+class CompiledPreprocessor:
+    """Encodes cars exactly like `preprocessor.transform`, without building a DataFrame"""
+
+    def __init__(self, preprocessor, input_features):
+        self.input_features = list(input_features)
+        self.n_output_features = sum(
+            indices.stop - indices.start for indices in preprocessor.output_indices_.values()
+        )
+        # The model was fitted on the sparse output of the preprocessor, where zeros are not stored
+        # and are therefore seen as missing values by XGBoost. Use NaN for them in the model input.
+        self.sparse_output = bool(getattr(preprocessor, 'sparse_output_', False))
+        self.model_fill_value = np.nan if self.sparse_output else 0.0
+
+        self.numeric = []  # (feature, output column, mean, scale)
+        self.categorical = []  # (feature, {category: output column})
+        self.categories = {}  # feature -> all fitted categories
+        for name, transformer, features in preprocessor.transformers_:
+            if transformer == 'drop' or len(features) == 0:
+                continue
+            step = transformer.steps[-1][1] if hasattr(transformer, 'steps') else transformer
+            if hasattr(transformer, 'steps') and len(transformer.steps) != 1:
+                raise ValueError(f"Cannot compile transformer '{name}': only single step pipelines are supported")
+            start = preprocessor.output_indices_[name].start
+
+            if hasattr(step, 'categories_'):
+                self._compile_encoder(step, features, start)
+            elif hasattr(step, 'scale_'):
+                self._compile_scaler(step, features, start)
+            else:
+                raise ValueError(f"Cannot compile transformer '{name}' of type {type(step).__name__}")
+
+        self._local = threading.local()
+
+    def _compile_scaler(self, scaler, features, start):
+        for position, feature in enumerate(features):
+            mean = scaler.mean_[position] if scaler.with_mean else 0.0
+            scale = scaler.scale_[position] if scaler.with_std else 1.0
+            self.numeric.append((feature, start + position, mean, scale))
+
+    def _compile_encoder(self, encoder, features, start):
+        if getattr(encoder, '_infrequent_enabled', False):
+            raise ValueError("Cannot compile a OneHotEncoder with infrequent categories")
+        if encoder.handle_unknown != 'ignore':
+            raise ValueError("Cannot compile a OneHotEncoder that raises on unknown categories")
+
+        column = start
+        for position, feature in enumerate(features):
+            drop_idx = None if encoder.drop_idx_ is None else encoder.drop_idx_[position]
+            categories = encoder.categories_[position].tolist()
+            self.categories[feature] = categories
+            mapping = {}
+            for category_idx, category in enumerate(categories):
+                if category_idx == drop_idx:
+                    continue
+                mapping[category] = column
+                column += 1
+            self.categorical.append((feature, mapping))
+
+    def _encode_one(self, row, out, fill_value):
+        out.fill(fill_value)
+        for feature, column, mean, scale in self.numeric:
+            value = (float(row[feature]) - mean) / scale
+            if value != 0.0 or not self.sparse_output:
+                out[column] = value
+        for feature, mapping in self.categorical:
+            column = mapping.get(row[feature])
+            if column is not None:  # unknown categories are encoded as all zeros
+                out[column] = 1.0
+        return out
+
+    def _encode_columns(self, columns, fill_value):
+        n_rows = len(columns[self.input_features[0]])
+        out = np.full((n_rows, self.n_output_features), fill_value)
+        row_idx = np.arange(n_rows)
+        for feature, column, mean, scale in self.numeric:
+            values = (np.asarray(columns[feature], dtype=np.float64) - mean) / scale
+            if self.sparse_output and fill_value != 0.0:
+                values[values == 0.0] = fill_value
+            out[:, column] = values
+        for feature, mapping in self.categorical:
+            output_columns = np.fromiter(
+                (mapping.get(value, -1) for value in columns[feature]), dtype=np.intp, count=n_rows
+            )
+            known = output_columns >= 0
+            out[row_idx[known], output_columns[known]] = 1.0
+        return out
+
+    def transform(self, columns):
+        """Same values as `preprocessor.transform(pd.DataFrame(columns)).toarray()`"""
+        return self._encode_columns(columns, 0.0)
+
+    def transform_for_model(self, columns):
+        """Encodes a columnar batch (dict of feature -> list of values) as a dense model input"""
+        return self._encode_columns(columns, self.model_fill_value)
+
+    def transform_rows_for_model(self, rows):
+        """Encodes a list of cars (one dict per car) as a dense model input"""
+        columns = {feature: [row[feature] for row in rows] for feature in self.input_features}
+        return self.transform_for_model(columns)
+
+    def transform_one_for_model(self, row):
+        """Encodes a single car into a per-thread preallocated (1, n_features) buffer.
+        The returned array is overwritten by the next call from the same thread."""
+        buffer = getattr(self._local, 'buffer', None)
+        if buffer is None:
+            buffer = self._local.buffer = np.empty((1, self.n_output_features))
+        self._encode_one(row, buffer[0], self.model_fill_value)
+        return buffer
+
+    def golden_sample(self):
+        """Builds a small columnar sample that goes through every category, dropped ones included"""
+        n_rows = max([len(categories) for categories in self.categories.values()] + [2])
+        columns = {}
+        for feature, categories in self.categories.items():
+            columns[feature] = [categories[i % len(categories)] for i in range(n_rows)]
+        for feature, _, mean, _ in self.numeric:
+            columns[feature] = [int(value) for value in np.linspace(0, 2 * mean, n_rows).round()]
+        return columns
+
+    def verify(self, preprocessor, model=None):
+        """Checks the compiled encoding against the fitted preprocessor (and model) on a golden sample.
+        Raises a RuntimeError if the outputs differ."""
+        import pandas as pd
+
+        columns = self.golden_sample()
+        input_df = pd.DataFrame(columns, columns=self.input_features)
+        expected = preprocessor.transform(input_df)
+        expected_dense = expected.toarray() if hasattr(expected, 'toarray') else np.asarray(expected)
+
+        compiled = self.transform(columns)
+        if not np.array_equal(compiled, expected_dense):
+            raise RuntimeError("Compiled preprocessor does not match preprocessor.transform on the golden sample")
+
+        rows = [dict(zip(columns, values)) for values in zip(*columns.values())]
+        single_rows = np.vstack([self.transform_one_for_model(row).copy() for row in rows])
+        if not np.array_equal(single_rows, self.transform_for_model(columns), equal_nan=True):
+            raise RuntimeError("Compiled preprocessor single-row and batch encodings differ on the golden sample")
+
+        if model is not None:
+            expected_predictions = model.predict(expected)
+            compiled_predictions = model.predict(self.transform_for_model(columns))
+            if not np.allclose(compiled_predictions, expected_predictions, rtol=1e-6, atol=1e-6):
+                raise RuntimeError("Predictions from the compiled preprocessor do not match the original ones")
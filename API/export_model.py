@@ -0,0 +1,56 @@
+"""
+Exports the pickled model to the formats used by the API at startup.
+
+Usage (from the API directory):
+    python export_model.py
+"""
+import argparse
+import pickle
+import joblib
+from compiled_preprocessor import CompiledPreprocessor
+from features import input_features
+from model_loading import file_sha256, native_model_path, tree_ensemble_path
+from tree_ensemble import TreeEnsemble
+
+
+def export_native(model_path):
+    """Saves the booster in XGBoost's native binary format next to the pickle,
+    along with the hash of the pickle so that a stale export is never loaded"""
+    model = joblib.load(model_path)
+    model.get_booster().set_attr(source_sha256=file_sha256(model_path))
+    native_path = native_model_path(model_path)
+    model.save_model(native_path)
+    return native_path
+
+
+def export_tree_ensemble(model_path, preprocessor_path):
+    """Flattens the trees into NumPy arrays and checks that they predict like the original model
+    on a golden sample going through every category of the preprocessor"""
+    model = joblib.load(model_path)
+    model.set_params(n_jobs=1)
+    tree_ensemble = TreeEnsemble.from_xgboost(model, metadata={"source_sha256": file_sha256(model_path)})
+
+    with open(preprocessor_path, 'rb') as file:
+        preprocessor = pickle.load(file)
+    compiled_preprocessor = CompiledPreprocessor(preprocessor, input_features)
+    golden_sample = compiled_preprocessor.transform_for_model(compiled_preprocessor.golden_sample())
+    max_difference = tree_ensemble.check_parity(model, golden_sample)
+
+    path = tree_ensemble_path(model_path)
+    tree_ensemble.save(path)
+    return path, max_difference
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the pickled model to the formats loaded by the API")
+    parser.add_argument('--model', default='best_model.pkl', help="Path of the pickled XGBoost model")
+    parser.add_argument('--preprocessor', default='preprocessor.pkl', help="Path of the pickled preprocessor")
+    args = parser.parse_args()
+
+    print(f"Saved the native XGBoost model to {export_native(args.model)}")
+    path, max_difference = export_tree_ensemble(args.model, args.preprocessor)
+    print(f"Saved the tree ensemble to {path} (largest difference with the model: {max_difference:.2e})")
+
+
+if __name__ == "__main__":
+    main()
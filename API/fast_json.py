@@ -0,0 +1,43 @@
+"""
+Optional fast JSON decoding and encoding with orjson.
+
+When orjson is installed (and FAST_JSON is not set to 0), request bodies are decoded with
+`orjson.loads` and responses are encoded with `ORJSONResponse`. Otherwise the standard
+library json module is used, as FastAPI does by default.
+"""
+import os
+from fastapi import Request
+from fastapi.responses import JSONResponse, ORJSONResponse
+from fastapi.routing import APIRoute
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+FAST_JSON = orjson is not None and os.environ.get('FAST_JSON', '1') != '0'
+
+
+class ORJSONRequest(Request):
+    async def json(self):
+        if not hasattr(self, '_json'):
+            # orjson.JSONDecodeError subclasses json.JSONDecodeError, so FastAPI still answers 422
+            self._json = orjson.loads(await self.body())
+        return self._json
+
+
+class ORJSONRoute(APIRoute):
+    """Route that decodes the request body with orjson"""
+
+    def get_route_handler(self):
+        route_handler = super().get_route_handler()
+
+        async def orjson_route_handler(request):
+            return await route_handler(ORJSONRequest(request.scope, request.receive))
+
+        return orjson_route_handler
+
+
+# Response and route classes used by the API
+ResponseClass = ORJSONResponse if FAST_JSON else JSONResponse
+RouteClass = ORJSONRoute if FAST_JSON else APIRoute
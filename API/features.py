@@ -0,0 +1,12 @@
+# Define the names of input features
+input_features = ['model_key', 'mileage', 'engine_power', 'fuel', 'paint_color',
+                  'car_type', 'private_parking_available', 'has_gps',
+                  'has_air_conditioning', 'automatic_car', 'has_getaround_connect',
+                  'has_speed_regulator', 'winter_tires']
+
+# Define numeric and categorical features based on input_features
+numeric_features = ['mileage', 'engine_power']
+categorical_features = [feature for feature in input_features if feature not in numeric_features]
+
+# Accepted ranges of the numeric features
+numeric_ranges = {'mileage': (0, 300000), 'engine_power': (0, 300)}
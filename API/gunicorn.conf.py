@@ -0,0 +1,17 @@
+# Gunicorn settings for the API
+import gc
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 8000)}"
+worker_class = "uvicorn.workers.UvicornWorker"
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+
+# Import the app (and load the model) once in the master process, the forked workers
+# then share the loaded model copy-on-write instead of each unpickling it again
+preload_app = True
+
+
+def pre_fork(server, worker):
+    # Move the objects created while loading the app to a permanent generation, so that
+    # garbage collections in the workers do not touch (and copy) the shared memory pages
+    gc.freeze()
@@ -0,0 +1,109 @@
+"""
+Lightweight in-process metrics for the API.
+"""
+import bisect
+import json
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+
+class Histogram:
+    """Prometheus-style histogram: cumulative counts per upper bound, plus count and sum"""
+
+    def __init__(self, buckets):
+        self.buckets = sorted(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)  # last slot is +Inf
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    def snapshot(self):
+        """Returns {"buckets": {upper bound: cumulative count}, "count": ..., "sum": ...}"""
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+        cumulative, buckets = 0, {}
+        for bound, count in zip(self.buckets + ['+Inf'], counts):
+            cumulative += count
+            buckets[str(bound)] = cumulative
+        return {"buckets": buckets, "count": cumulative, "sum": total}
+
+
+# Latency buckets in seconds, from 50 microseconds to 2.5 seconds
+LATENCY_BUCKETS = [0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5]
+
+
+class StageTimings:
+    """One latency histogram per named stage of the prediction path"""
+
+    def __init__(self, stages, buckets=LATENCY_BUCKETS):
+        self.histograms = {stage: Histogram(buckets) for stage in stages}
+
+    def observe(self, stage, seconds):
+        self.histograms[stage].observe(seconds)
+
+    @contextmanager
+    def time(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.histograms[stage].observe(time.perf_counter() - start)
+
+    def snapshot(self):
+        return {stage: histogram.snapshot() for stage, histogram in self.histograms.items()}
+
+
+class PayloadSampler:
+    """Logs a random sample of the prediction payloads as JSON lines"""
+
+    def __init__(self, rate, logger):
+        self.rate = rate
+        self.logger = logger
+
+    def maybe_log(self, event, **fields):
+        if self.rate > 0 and random.random() < self.rate:
+            self.logger.info(json.dumps({"event": event, **fields}, default=str))
+
+
+class RequestStartMiddleware:
+    """ASGI middleware that stores the time a request arrived in `request.state.request_start`,
+    so that the endpoints can measure how long body decoding and validation took"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http':
+            scope.setdefault('state', {})['request_start'] = time.perf_counter()
+        await self.app(scope, receive, send)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in labels.items()) + '}'
+
+
+def format_histogram(name, description, snapshots):
+    """Prometheus text format for a histogram, `snapshots` is a list of (labels, snapshot) pairs"""
+    lines = [f'# HELP {name} {description}', f'# TYPE {name} histogram']
+    for labels, snapshot in snapshots:
+        for bound, count in snapshot['buckets'].items():
+            lines.append(f'{name}_bucket{_format_labels({**labels, "le": bound})} {count}')
+        lines.append(f'{name}_sum{_format_labels(labels)} {snapshot["sum"]}')
+        lines.append(f'{name}_count{_format_labels(labels)} {snapshot["count"]}')
+    return lines
+
+
+def format_metric(name, description, metric_type, value):
+    """Prometheus text format for a single counter or gauge"""
+    return [f'# HELP {name} {description}', f'# TYPE {name} {metric_type}', f'{name} {value}']
@@ -0,0 +1,96 @@
+"""
+Loading of the model and the preprocessor at API startup, with a breakdown of the time spent in each step.
+
+The XGBoost model is loaded from its native format (`best_model.ubj`, written by `export_model.py`)
+when it is available and was exported from the current pickle, and from the pickle otherwise. Both
+take a few milliseconds: most of the `load_model` step is the import of xgboost itself.
+"""
+import hashlib
+import logging
+import os
+import pickle
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+logger = logging.getLogger("getaround.api")
+
+
+class StartupTimer:
+    """Records how long each startup step took, in the order they ran"""
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.steps = OrderedDict()
+
+    @contextmanager
+    def step(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.steps[name] = time.perf_counter() - start
+
+    def breakdown(self):
+        return {
+            "steps_seconds": dict(self.steps),
+            "total_seconds": sum(self.steps.values()),
+        }
+
+
+def native_model_path(model_path):
+    """Path of the native XGBoost export that goes with a pickled model"""
+    return os.path.splitext(model_path)[0] + '.ubj'
+
+
+def tree_ensemble_path(model_path):
+    """Path of the flattened tree ensemble export that goes with a pickled model"""
+    return os.path.splitext(model_path)[0] + '.npz'
+
+
+def file_sha256(path):
+    with open(path, 'rb') as file:
+        return hashlib.sha256(file.read()).hexdigest()
+
+
+def load_model(model_path, n_threads=1):
+    """Loads the XGBoost regressor, from its native export when it was exported from this pickle.
+    Returns the model and the path it was loaded from."""
+    model, loaded_from = None, model_path
+    native_path = native_model_path(model_path)
+    if os.path.exists(native_path):
+        import xgboost as xgb
+        native_model = xgb.XGBRegressor()
+        native_model.load_model(native_path)
+        # The export records the hash of the pickle it comes from, ignore it if the pickle changed since
+        if native_model.get_booster().attr('source_sha256') == file_sha256(model_path):
+            model, loaded_from = native_model, native_path
+        else:
+            logger.warning("%s is out of date, loading %s instead", native_path, model_path)
+
+    if model is None:
+        import joblib
+        model = joblib.load(model_path)
+
+    # Requests are predicted in small batches, where OpenMP threads cost more than they bring.
+    # A single thread also keeps the model safe to share with forked gunicorn workers.
+    model.set_params(n_jobs=n_threads)
+    return model, loaded_from
+
+
+def load_tree_ensemble(model_path):
+    """Loads the flattened tree ensemble exported from this pickle, or returns None"""
+    path = tree_ensemble_path(model_path)
+    if not os.path.exists(path):
+        return None
+    from tree_ensemble import TreeEnsemble
+    tree_ensemble = TreeEnsemble.load(path)
+    if tree_ensemble.metadata.get('source_sha256') != file_sha256(model_path):
+        logger.warning("%s is out of date, it will not be used", path)
+        return None
+    return tree_ensemble
+
+
+def load_preprocessor(preprocessor_path):
+    with open(preprocessor_path, 'rb') as file:
+        return pickle.load(file)
@@ -0,0 +1,305 @@
+"""
+Versioned model bundles, and the registry that decides which one serves the predictions.
+
+A bundle is a model and the preprocessor it was trained with, loaded and checked together: the
+preprocessor is compiled and verified against the original one, the tree ensemble export is used
+when it predicts like the model, and a few synthetic predictions warm everything up before the
+bundle serves any request.
+
+Bundles live in a registry directory (MODEL_REGISTRY_DIR), one sub-directory per version:
+    models/
+    ├── registry.json   {"active": "v2", "candidate": "v3", "candidate_traffic": 0.05}
+    ├── v2/             best_model.pkl, preprocessor.pkl and the files written by export_model.py
+    └── v3/
+The version 'default' is the best_model.pkl and preprocessor.pkl next to the API, which are served
+when there is no registry.json.
+
+Every worker re-reads registry.json periodically. A new active version is loaded and warmed up
+first, then swapped in by replacing a single reference, so requests already running finish on
+the bundle they started with. A share of the requests (`candidate_traffic`) is also predicted by
+the candidate version in the background, to compare its latency and predictions with the active
+version without serving them (shadow traffic).
+"""
+import json
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+import numpy as np
+from compiled_preprocessor import CompiledPreprocessor
+from features import input_features
+from metrics import LATENCY_BUCKETS, Histogram
+from model_loading import StartupTimer, load_model, load_preprocessor, load_tree_ensemble
+
+logger = logging.getLogger("getaround.api")
+
+DEFAULT_VERSION = 'default'
+MODEL_FILE = 'best_model.pkl'
+PREPROCESSOR_FILE = 'preprocessor.pkl'
+REGISTRY_FILE = 'registry.json'
+
+# Shadow predictions waiting to run, above which new ones are skipped rather than queued
+MAX_PENDING_SHADOWS = 64
+
+
+class ModelBundle:
+    """A loaded model with its compiled preprocessor and, when available, its tree ensemble"""
+
+    def __init__(self, version, model, model_loaded_from, compiled_preprocessor, tree_ensemble=None,
+                 tree_ensemble_max_rows=16):
+        self.version = version
+        self.model = model
+        self.model_loaded_from = model_loaded_from
+        self.compiled_preprocessor = compiled_preprocessor
+        self.tree_ensemble = tree_ensemble
+        self.tree_ensemble_max_rows = tree_ensemble_max_rows
+        self.predict_latency = Histogram(LATENCY_BUCKETS)
+
+    @property
+    def categories(self):
+        return self.compiled_preprocessor.categories
+
+    def predict_rows(self, rows, timings=None):
+        """Predicts the rental price of a list of cars (dicts) with a single model call"""
+        start = time.perf_counter()
+        with timings.time('transform') if timings is not None else nullcontext():
+            if len(rows) == 1:
+                preprocessed_data = self.compiled_preprocessor.transform_one_for_model(rows[0])
+            else:
+                preprocessed_data = self.compiled_preprocessor.transform_rows_for_model(rows)
+        # The tree ensemble is faster on small batches, XGBoost's C++ predictor on large ones
+        use_tree_ensemble = self.tree_ensemble is not None and len(rows) <= self.tree_ensemble_max_rows
+        predictor = self.tree_ensemble if use_tree_ensemble else self.model
+        with timings.time('predict') if timings is not None else nullcontext():
+            predictions = predictor.predict(preprocessed_data).tolist()
+        self.predict_latency.observe(time.perf_counter() - start)
+        return predictions
+
+    def warm_up(self):
+        """Runs synthetic predictions through every path (single car, small and large batches)"""
+        golden_sample = self.compiled_preprocessor.golden_sample()
+        rows = [dict(zip(golden_sample, values)) for values in zip(*golden_sample.values())]
+        large_batch = rows * (self.tree_ensemble_max_rows // len(rows) + 1)
+        for _ in range(3):
+            self.predict_rows(rows[:1])
+            self.predict_rows(rows)
+            self.predict_rows(large_batch)
+        # Only report the latency of the predictions it serves
+        self.predict_latency = Histogram(LATENCY_BUCKETS)
+
+    def describe(self):
+        return {
+            "version": self.version,
+            "model": self.model_loaded_from,
+            "tree_ensemble": self.tree_ensemble is not None,
+            "predict_latency": self.predict_latency.snapshot(),
+        }
+
+
+def load_bundle(version, directory, model_threads=1, inference_backend='auto', tree_ensemble_max_rows=16,
+                timer=None):
+    """Loads, checks and warms up the model and preprocessor of a directory.
+    Raises a RuntimeError if the compiled preprocessor does not match the original one."""
+    timer = timer or StartupTimer()
+    model_path = os.path.join(directory, MODEL_FILE)
+
+    # Load trained model (from its native XGBoost export when available)
+    with timer.step('load_model'):
+        model, model_loaded_from = load_model(model_path, n_threads=model_threads)
+    with timer.step('load_preprocessor'):
+        preprocessor = load_preprocessor(os.path.join(directory, PREPROCESSOR_FILE))
+
+    # Compile the preprocessor into lookup tables for DataFrame-free inference,
+    # and check that it gives the same outputs as the original one before serving anything
+    with timer.step('compile_preprocessor'):
+        compiled_preprocessor = CompiledPreprocessor(preprocessor, input_features)
+    with timer.step('verify_preprocessor'):
+        compiled_preprocessor.verify(preprocessor, model)
+
+    # Load the exported tree ensemble, and only use it if it predicts like the model on the golden sample
+    tree_ensemble = None
+    if inference_backend == 'auto':
+        with timer.step('load_tree_ensemble'):
+            tree_ensemble = load_tree_ensemble(model_path)
+            if tree_ensemble is not None:
+                try:
+                    tree_ensemble.check_parity(
+                        model, compiled_preprocessor.transform_for_model(compiled_preprocessor.golden_sample())
+                    )
+                except RuntimeError:
+                    logger.exception("Tree ensemble of version %s disabled", version)
+                    tree_ensemble = None
+
+    bundle = ModelBundle(version, model, model_loaded_from, compiled_preprocessor, tree_ensemble,
+                         tree_ensemble_max_rows)
+    with timer.step('warm_up'):
+        bundle.warm_up()
+    logger.info("Model version %s loaded from %s in %.3f seconds (tree ensemble %s)", version, model_loaded_from,
+                timer.breakdown()["total_seconds"], "enabled" if tree_ensemble is not None else "disabled")
+    return bundle
+
+
+class ModelRegistry:
+    """Active and candidate model bundles, following the registry.json of a registry directory"""
+
+    def __init__(self, directory, default_directory='.', on_swap=None, **load_options):
+        self.directory = directory
+        self.default_directory = default_directory
+        # Called with (previous bundle, new bundle) after the active bundle changed
+        self.on_swap = on_swap
+        self.load_options = load_options
+        self.active = None
+        self.candidate = None
+        self.candidate_traffic = 0.0
+        self.swaps = 0
+        self.shadow_stats = {}
+        # Held while the versions change, from reading registry.json to writing it
+        self._lock = threading.RLock()
+        self._stats_lock = threading.Lock()
+        self._shadow_executor = None
+        self._pending_shadows = 0
+
+    @property
+    def config_path(self):
+        return os.path.join(self.directory, REGISTRY_FILE)
+
+    def available_versions(self):
+        """Versions that can be served: 'default' and the sub-directories holding a model"""
+        versions = [DEFAULT_VERSION]
+        if os.path.isdir(self.directory):
+            versions += sorted(name for name in os.listdir(self.directory)
+                               if name != DEFAULT_VERSION and os.path.isfile(os.path.join(self.directory, name, MODEL_FILE)))
+        return versions
+
+    def read_config(self):
+        if not os.path.exists(self.config_path):
+            return {}
+        with open(self.config_path) as file:
+            return json.load(file)
+
+    def write_config(self, config):
+        """Publishes the versions to serve to all the workers, atomically"""
+        if not os.path.isdir(self.directory):
+            raise FileNotFoundError(f"No model registry directory {self.directory}")
+        temporary_path = self.config_path + '.tmp'
+        with open(temporary_path, 'w') as file:
+            json.dump(config, file, indent=2)
+        os.replace(temporary_path, self.config_path)
+
+    def load(self, version, timer=None):
+        if version not in self.available_versions():
+            raise KeyError(f"Unknown model version {version}")
+        directory = self.default_directory if version == DEFAULT_VERSION else os.path.join(self.directory, version)
+        return load_bundle(version, directory, timer=timer, **self.load_options)
+
+    def _check_schema(self, bundle):
+        # The request schemas are built at startup from the categories of the first active bundle
+        if self.active is not None and bundle.categories != self.active.categories:
+            raise ValueError(f"Model version {bundle.version} does not accept the same categories as version "
+                             f"{self.active.version}, restart the API to serve it")
+
+    def _apply(self, active_version, candidate_version, candidate_traffic, timer=None):
+        """Loads what changed, then swaps the active and candidate bundles.
+        Bundles already loaded (a promoted candidate for instance) are reused as they are."""
+        with self._lock:
+            loaded = {bundle.version: bundle for bundle in (self.active, self.candidate) if bundle is not None}
+            active = loaded.get(active_version)
+            if active is None:
+                active = self.load(active_version, timer)
+                self._check_schema(active)
+
+            candidate = None
+            if candidate_version is not None and candidate_version != active_version:
+                candidate = loaded.get(candidate_version)
+                if candidate is None:
+                    candidate = self.load(candidate_version)
+                    self._check_schema(candidate)
+
+            previous, self.active = self.active, active
+            self.candidate = candidate
+            self.candidate_traffic = min(max(float(candidate_traffic), 0.0), 1.0) if candidate is not None else 0.0
+            if previous is not None and previous is not active:
+                self.swaps += 1
+                logger.info("Active model version changed from %s to %s", previous.version, active.version)
+                if self.on_swap is not None:
+                    self.on_swap(previous, active)
+
+    def sync(self, timer=None):
+        """Serves the versions set in registry.json ('default' when there is none)"""
+        with self._lock:
+            config = self.read_config()
+            self._apply(config.get('active') or DEFAULT_VERSION, config.get('candidate'),
+                        config.get('candidate_traffic', 0.0), timer)
+
+    def activate(self, version):
+        """Loads and serves a version in this worker, then publishes it for the other workers.
+        Promoting the candidate also ends its shadow traffic."""
+        with self._lock:
+            config = self.read_config()
+            candidate_version, candidate_traffic = config.get('candidate'), config.get('candidate_traffic', 0.0)
+            if candidate_version == version:
+                candidate_version, candidate_traffic = None, 0.0
+            self._apply(version, candidate_version, candidate_traffic)
+            self.write_config(dict(config, active=version, candidate=candidate_version,
+                                   candidate_traffic=candidate_traffic))
+
+    def set_candidate(self, version, traffic):
+        """Loads a candidate version in this worker, then publishes it for the other workers.
+        A version of None removes the candidate. Raises a ValueError for the active version."""
+        with self._lock:
+            if version is not None and version == self.active.version:
+                raise ValueError(f"Model version {version} is already the active version")
+            config = self.read_config()
+            self._apply(self.active.version, version, traffic)
+            self.write_config(dict(config, active=self.active.version, candidate=version,
+                                   candidate_traffic=traffic if version is not None else 0.0))
+
+    def should_shadow(self):
+        return self.candidate is not None and random.random() < self.candidate_traffic
+
+    def submit_shadow(self, rows, predictions):
+        """Predicts the cars with the candidate in the background and records how it compares
+        with the predictions of the active version. Skipped when too many are already waiting."""
+        candidate = self.candidate
+        if candidate is None or self._pending_shadows >= MAX_PENDING_SHADOWS:
+            return
+        if self._shadow_executor is None:
+            self._shadow_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='shadow')
+        with self._stats_lock:
+            self._pending_shadows += 1
+        self._shadow_executor.submit(self._shadow, candidate, rows, predictions)
+
+    def _shadow(self, candidate, rows, predictions):
+        try:
+            differences = np.abs(np.asarray(candidate.predict_rows(rows)) - np.asarray(predictions))
+            with self._stats_lock:
+                stats = self.shadow_stats.setdefault(candidate.version, {
+                    "requests": 0, "rows": 0, "sum_abs_difference": 0.0, "max_abs_difference": 0.0,
+                })
+                stats["requests"] += 1
+                stats["rows"] += len(rows)
+                stats["sum_abs_difference"] += float(differences.sum())
+                stats["max_abs_difference"] = max(stats["max_abs_difference"], float(differences.max(initial=0.0)))
+        except Exception:
+            logger.exception("Shadow prediction with model version %s failed", candidate.version)
+        finally:
+            with self._stats_lock:
+                self._pending_shadows -= 1
+
+    def stats(self):
+        with self._stats_lock:
+            shadow_stats = {
+                version: dict(stats, mean_abs_difference=stats["sum_abs_difference"] / stats["rows"] if stats["rows"] else None)
+                for version, stats in self.shadow_stats.items()
+            }
+        return {
+            "active": self.active.describe() if self.active is not None else None,
+            "candidate": self.candidate.describe() if self.candidate is not None else None,
+            "candidate_traffic": self.candidate_traffic,
+            "available_versions": self.available_versions(),
+            "swaps": self.swaps,
+            "shadow": shadow_stats,
+        }
@@ -0,0 +1,92 @@
+"""
+In-process LRU/TTL cache of predictions, keyed on the normalized feature tuple of a car.
+
+Owners query the same car over and over while editing their listing, and apart from
+`mileage` and `engine_power` every feature is categorical, so the hit rate is high.
+The API keys the entries on the model version too, and empties the cache when it serves another version.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class PredictionCache:
+    def __init__(self, input_features, max_size=10000, ttl_seconds=3600, mileage_bucket=0):
+        """`mileage_bucket` > 0 rounds the mileage to the nearest multiple of it, both in the key
+        and in the car sent to the model, so that all cars of a bucket get the same prediction"""
+        self.input_features = list(input_features)
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.mileage_bucket = mileage_bucket
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self._entries = OrderedDict()  # key -> (prediction, expiry time)
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.max_size > 0
+
+    def normalize(self, row):
+        """Returns the car as it is sent to the model (mileage bucketed if enabled)"""
+        if self.mileage_bucket > 0:
+            row = dict(row, mileage=int(round(row['mileage'] / self.mileage_bucket)) * self.mileage_bucket)
+        return row
+
+    def key(self, row):
+        """Canonical feature tuple of a normalized car"""
+        return tuple(row[feature] for feature in self.input_features)
+
+    def get(self, key):
+        """Returns the cached prediction, or None"""
+        if not self.enabled:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            prediction, expires_at = entry
+            if expires_at < now:
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return prediction
+
+    def put(self, key, prediction):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._entries[key] = (prediction, time.monotonic() + self.ttl_seconds)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl_seconds,
+                "mileage_bucket": self.mileage_bucket,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
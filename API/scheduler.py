@@ -0,0 +1,115 @@
+"""
+Micro-batching scheduler for the prediction endpoint.
+
+Concurrent requests are queued and grouped into small batches (up to `max_batch_size` cars).
+A request that finds a thread idle and nobody else waiting is sent right away; while all the
+threads are busy, a batch waits at most `max_wait_ms` to fill up. Each batch is run in a thread pool,
+so the CPU-bound preprocessing and prediction never block the event loop, and each caller
+gets back its own prediction.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from metrics import Histogram
+
+BATCH_SIZE_BUCKETS = [1, 2, 4, 8, 16, 32, 64, 128, 256, 512]
+QUEUE_DEPTH_BUCKETS = [0, 1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024]
+
+
+class MicroBatchScheduler:
+    def __init__(self, predict_batch, max_batch_size=32, max_wait_ms=2.0, n_threads=1):
+        """`predict_batch` takes a list of cars (dicts) and returns one prediction per car, in order"""
+        self.predict_batch = predict_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.n_threads = n_threads
+        self.executor = None
+        self.batch_size_histogram = Histogram(BATCH_SIZE_BUCKETS)
+        self.queue_depth_histogram = Histogram(QUEUE_DEPTH_BUCKETS)
+        self._queue = None
+        self._collector = None
+        self._slots = None
+        self._running_batches = set()
+
+    async def start(self):
+        self.executor = ThreadPoolExecutor(max_workers=self.n_threads, thread_name_prefix='prediction')
+        self._queue = asyncio.Queue()
+        self._slots = asyncio.Semaphore(self.n_threads)
+        self._collector = asyncio.create_task(self._collect())
+
+    async def stop(self):
+        if self._collector is not None:
+            self._collector.cancel()
+            try:
+                await self._collector
+            except asyncio.CancelledError:
+                pass
+            self._collector = None
+        if self._running_batches:
+            await asyncio.gather(*self._running_batches, return_exceptions=True)
+        self.executor.shutdown(wait=True)
+
+    @property
+    def queue_depth(self):
+        return 0 if self._queue is None else self._queue.qsize()
+
+    async def submit(self, row):
+        """Queues one car and waits for its prediction"""
+        future = asyncio.get_running_loop().create_future()
+        self.queue_depth_histogram.observe(self.queue_depth)
+        await self._queue.put((row, future))
+        return await future
+
+    async def run_in_executor(self, function, *args):
+        """Runs a blocking call in the prediction thread pool"""
+        return await asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            # Only wait for the batch to fill up when no thread could run it now anyway
+            if self._slots.locked():
+                deadline = loop.time() + self.max_wait
+                while len(batch) < self.max_batch_size:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                    except asyncio.TimeoutError:
+                        break
+
+            # Keep at most one batch in flight per thread, the next one builds up in the meantime
+            await self._slots.acquire()
+            # Drain whatever else is already waiting, without waiting any longer
+            while len(batch) < self.max_batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            task = asyncio.create_task(self._run_batch(batch))
+            self._running_batches.add(task)
+            task.add_done_callback(self._running_batches.discard)
+
+    async def _run_batch(self, batch):
+        try:
+            self.batch_size_histogram.observe(len(batch))
+            rows = [row for row, _ in batch]
+            try:
+                predictions = await self.run_in_executor(self.predict_batch, rows)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                return
+            for (_, future), prediction in zip(batch, predictions):
+                if not future.done():
+                    future.set_result(prediction)
+        finally:
+            self._slots.release()
+
+    def stats(self):
+        return {
+            "queue_depth": self.queue_depth,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+            "batch_size": self.batch_size_histogram.snapshot(),
+            "queue_depth_at_submit": self.queue_depth_histogram.snapshot(),
+        }
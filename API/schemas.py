@@ -0,0 +1,69 @@
+"""
+Request validation built from the categories fitted by the preprocessor.
+
+The accepted values of each categorical feature are read from the fitted OneHotEncoder, so the
+API schema and the model cannot drift apart. They are validated with enum (single predictions)
+or frozenset (batch predictions) lookups instead of regular expressions.
+"""
+from enum import Enum
+from pydantic import BaseConfig, conint, create_model
+from features import input_features, numeric_ranges
+
+
+class FeaturesConfig(BaseConfig):
+    # Keep plain strings in the validated model, they are used as-is by the preprocessor and the cache
+    use_enum_values = True
+
+
+def make_features_model(categories):
+    """Builds the RentalPredictionFeatures pydantic model from {feature: fitted categories}"""
+    fields = {}
+    for feature in input_features:
+        if feature in numeric_ranges:
+            low, high = numeric_ranges[feature]
+            fields[feature] = (conint(ge=low, le=high), ...)
+        elif all(isinstance(category, bool) for category in categories[feature]):
+            fields[feature] = (bool, ...)
+        else:
+            enum_name = ''.join(part.capitalize() for part in feature.split('_'))
+            vocabulary = Enum(enum_name, {category: category for category in categories[feature]}, type=str)
+            fields[feature] = (vocabulary, ...)
+    return create_model('RentalPredictionFeatures', __config__=FeaturesConfig, **fields)
+
+
+class RowValidator:
+    """Validates the cars of a batch with frozenset and type checks, and only falls back to the
+    pydantic model (which gives the detailed errors) for the rows that fail these checks"""
+
+    def __init__(self, features_model, categories):
+        self.features_model = features_model
+        self.vocabularies = []
+        self.bool_features = []
+        for feature in input_features:
+            if feature in numeric_ranges:
+                continue
+            if all(isinstance(category, bool) for category in categories[feature]):
+                self.bool_features.append(feature)
+            else:
+                self.vocabularies.append((feature, frozenset(categories[feature])))
+        self.numeric_ranges = [(feature, low, high) for feature, (low, high) in numeric_ranges.items()]
+
+    def _is_clean(self, row):
+        for feature, vocabulary in self.vocabularies:
+            value = row.get(feature)
+            if type(value) is not str or value not in vocabulary:
+                return False
+        for feature in self.bool_features:
+            if type(row.get(feature)) is not bool:
+                return False
+        for feature, low, high in self.numeric_ranges:
+            value = row.get(feature)
+            if type(value) is not int or not low <= value <= high:
+                return False
+        return True
+
+    def validate(self, row):
+        """Returns the car as a dict of input features, raises pydantic's ValidationError if invalid"""
+        if isinstance(row, dict) and self._is_clean(row):
+            return {feature: row[feature] for feature in input_features}
+        return self.features_model.parse_obj(row).dict()
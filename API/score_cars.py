@@ -0,0 +1,99 @@
+"""
+Offline scoring of the rental price of a fleet of cars, used by the revenue impact view of the dashboard.
+
+Reads a CSV of cars (a `car_id` column and the model's input features) and predicts the rental
+price per day of each distinct feature vector once, in batches. Prices already computed with the
+same model and preprocessor are read from a cache file instead of being scored again, so scoring
+an updated fleet only predicts the new feature vectors.
+
+Usage (from the API directory):
+    python score_cars.py cars.csv ../Dashboard/car_prices.csv
+"""
+import argparse
+import os
+import time
+import pandas as pd
+from compiled_preprocessor import CompiledPreprocessor
+from features import input_features
+from model_loading import file_sha256, load_model, load_preprocessor
+
+PRICE_COLUMN = 'rental_price_per_day'
+
+
+def model_version(model_path, preprocessor_path):
+    """Identifies the model and preprocessor pair that prices were computed with"""
+    return file_sha256(model_path)[:16] + '-' + file_sha256(preprocessor_path)[:16]
+
+
+def score_feature_vectors(feature_vectors, compiled_preprocessor, model, batch_size):
+    """Predicts the price of each row of a DataFrame of input features, `batch_size` rows per model call"""
+    prices = []
+    for start in range(0, len(feature_vectors), batch_size):
+        batch = feature_vectors.iloc[start:start + batch_size]
+        columns = {feature: batch[feature].tolist() for feature in input_features}
+        prices.extend(model.predict(compiled_preprocessor.transform_for_model(columns)).tolist())
+    return prices
+
+
+def read_price_cache(cache_path, version):
+    """Feature vectors already scored by this model version, with their price"""
+    if not cache_path or not os.path.exists(cache_path):
+        return pd.DataFrame(columns=input_features + [PRICE_COLUMN])
+    cache = pd.read_csv(cache_path, float_precision='round_trip')
+    return cache.loc[cache['model_version'] == version, input_features + [PRICE_COLUMN]]
+
+
+def score_cars(cars, model_path, preprocessor_path, batch_size=10000, cache_path=None, n_threads=-1):
+    """Returns the price per day of each car (car_id, rental_price_per_day) and scoring statistics"""
+    missing = [column for column in ['car_id'] + input_features if column not in cars.columns]
+    if missing:
+        raise ValueError(f"Missing columns in the cars file: {', '.join(missing)}")
+
+    version = model_version(model_path, preprocessor_path)
+    feature_vectors = cars[input_features].drop_duplicates(ignore_index=True)
+    cached = read_price_cache(cache_path, version)
+    feature_vectors = feature_vectors.merge(cached, on=input_features, how='left')
+    to_score = feature_vectors[PRICE_COLUMN].isna().to_numpy()
+
+    if to_score.any():
+        model, _ = load_model(model_path, n_threads=n_threads)
+        compiled_preprocessor = CompiledPreprocessor(load_preprocessor(preprocessor_path), input_features)
+        feature_vectors.loc[to_score, PRICE_COLUMN] = score_feature_vectors(
+            feature_vectors[to_score], compiled_preprocessor, model, batch_size
+        )
+        feature_vectors[PRICE_COLUMN] = feature_vectors[PRICE_COLUMN].astype('float64')
+        if cache_path:
+            new_entries = feature_vectors[to_score].assign(model_version=version)
+            new_entries.to_csv(cache_path, mode='a', header=not os.path.exists(cache_path), index=False)
+
+    prices = cars[['car_id'] + input_features].merge(feature_vectors, on=input_features, how='left')
+    stats = {"cars": len(cars), "feature_vectors": len(feature_vectors), "scored": int(to_score.sum())}
+    return prices[['car_id', PRICE_COLUMN]], stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Predict the rental price per day of a fleet of cars")
+    parser.add_argument('cars', help="CSV file with a car_id column and the model input features")
+    parser.add_argument('output', help="Where to write the car_id, rental_price_per_day CSV file")
+    parser.add_argument('--model', default='best_model.pkl', help="Path of the pickled XGBoost model")
+    parser.add_argument('--preprocessor', default='preprocessor.pkl', help="Path of the pickled preprocessor")
+    parser.add_argument('--batch-size', type=int, default=10000, help="Number of cars per model call")
+    parser.add_argument('--cache', default='price_cache.csv',
+                        help="File of the prices already computed, per feature vector and model version ('' to disable)")
+    parser.add_argument('--threads', type=int, default=-1, help="Number of XGBoost threads (default: all cores)")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    try:
+        prices, stats = score_cars(pd.read_csv(args.cars), args.model, args.preprocessor,
+                                   args.batch_size, args.cache, args.threads)
+    except ValueError as error:
+        parser.error(str(error))
+    prices.to_csv(args.output, index=False)
+    print(f"Priced {stats['cars']} cars ({stats['feature_vectors']} distinct feature vectors, "
+          f"{stats['scored']} scored, the others cached) in {time.perf_counter() - start:.2f} s")
+    print(f"Saved the prices to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
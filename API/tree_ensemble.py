@@ -0,0 +1,130 @@
+"""
+Self-contained tree ensemble evaluated with vectorized NumPy, exported from the XGBoost model.
+
+All the trees are flattened into a few node arrays (split feature, threshold, children, default
+direction for missing values, leaf value). Leaves point to themselves, so evaluating every tree
+for every row is a fixed number (the maximum depth) of vectorized gathers, with no DMatrix and
+no per-call overhead from the XGBoost sklearn wrapper.
+"""
+import json
+import numpy as np
+
+
+class TreeEnsemble:
+    def __init__(self, roots, feature, threshold, left, right, default_left, value, base_score, max_depth,
+                 n_features, metadata=None):
+        self.roots = roots
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.default_left = default_left
+        self.value = value
+        self.base_score = np.float32(base_score)
+        self.max_depth = int(max_depth)
+        self.n_features = int(n_features)
+        self.metadata = metadata or {}
+
+    @classmethod
+    def from_xgboost(cls, model, metadata=None):
+        """Flattens a fitted XGBRegressor (gbtree booster, squared error objective)"""
+        booster = model.get_booster()
+        learner = json.loads(booster.save_raw('json'))['learner']
+        if learner['gradient_booster']['name'] != 'gbtree':
+            raise ValueError("Only gbtree boosters can be exported")
+        if learner['objective']['name'] not in ('reg:squarederror', 'reg:linear'):
+            raise ValueError(f"Unsupported objective {learner['objective']['name']}")
+
+        trees = learner['gradient_booster']['model']['trees']
+        # Same trees as model.predict, which stops at the best iteration when early stopping was used
+        best_iteration = booster.attr('best_iteration')
+        if best_iteration is not None:
+            trees = trees[:int(best_iteration) + 1]
+
+        roots, features, thresholds, lefts, rights, default_lefts, values = [], [], [], [], [], [], []
+        offset, max_depth = 0, 0
+        for tree in trees:
+            if any(split_type != 0 for split_type in tree['split_type']):
+                raise ValueError("Categorical splits are not supported")
+            left = np.asarray(tree['left_children'], dtype=np.int32)
+            right = np.asarray(tree['right_children'], dtype=np.int32)
+            n_nodes = len(left)
+            is_leaf = left == -1
+            node_ids = np.arange(n_nodes, dtype=np.int32)
+
+            roots.append(offset)
+            features.append(np.where(is_leaf, 0, tree['split_indices']).astype(np.int32))
+            # On leaves the split condition holds the leaf value
+            split_conditions = np.asarray(tree['split_conditions'], dtype=np.float32)
+            thresholds.append(np.where(is_leaf, np.float32(np.inf), split_conditions))
+            values.append(np.where(is_leaf, split_conditions, np.float32(0)))
+            lefts.append(np.where(is_leaf, node_ids, left) + offset)
+            rights.append(np.where(is_leaf, node_ids, right) + offset)
+            default_lefts.append(np.asarray(tree['default_left'], dtype=bool))
+            max_depth = max(max_depth, _tree_depth(left, right))
+            offset += n_nodes
+
+        return cls(
+            roots=np.asarray(roots, dtype=np.int32),
+            feature=np.concatenate(features),
+            threshold=np.concatenate(thresholds).astype(np.float32),
+            left=np.concatenate(lefts).astype(np.int32),
+            right=np.concatenate(rights).astype(np.int32),
+            default_left=np.concatenate(default_lefts),
+            value=np.concatenate(values).astype(np.float32),
+            base_score=float(learner['learner_model_param']['base_score']),
+            max_depth=max_depth,
+            n_features=int(learner['learner_model_param']['num_feature']),
+            metadata=metadata,
+        )
+
+    def save(self, path):
+        np.savez(
+            path, roots=self.roots, feature=self.feature, threshold=self.threshold, left=self.left,
+            right=self.right, default_left=self.default_left, value=self.value,
+            base_score=self.base_score, max_depth=self.max_depth, n_features=self.n_features,
+            metadata=json.dumps(self.metadata),
+        )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as arrays:
+            return cls(
+                roots=arrays['roots'], feature=arrays['feature'], threshold=arrays['threshold'],
+                left=arrays['left'], right=arrays['right'], default_left=arrays['default_left'],
+                value=arrays['value'], base_score=arrays['base_score'], max_depth=arrays['max_depth'],
+                n_features=arrays['n_features'], metadata=json.loads(str(arrays['metadata'])),
+            )
+
+    def predict(self, X):
+        """Predictions for a dense (n_rows, n_features) array, NaN meaning missing like in XGBoost"""
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim != 2 or X.shape[1] != self.n_features:
+            raise ValueError(f"Expected an array of shape (n_rows, {self.n_features}), got {X.shape}")
+        rows = np.arange(X.shape[0])[:, None]
+        nodes = np.broadcast_to(self.roots, (X.shape[0], len(self.roots)))
+        for _ in range(self.max_depth):
+            x = X[rows, self.feature[nodes]]
+            go_left = np.where(np.isnan(x), self.default_left[nodes], x < self.threshold[nodes])
+            nodes = np.where(go_left, self.left[nodes], self.right[nodes])
+        return self.value[nodes].sum(axis=1, dtype=np.float32) + self.base_score
+
+    def check_parity(self, model, X, rtol=1e-5, atol=1e-3):
+        """Compares the predictions with the original model on X, returns the largest absolute difference.
+        Raises a RuntimeError if they differ by more than the tolerance."""
+        expected = model.predict(X)
+        predicted = self.predict(X)
+        if not np.allclose(predicted, expected, rtol=rtol, atol=atol):
+            raise RuntimeError("Tree ensemble predictions do not match the original model")
+        return float(np.max(np.abs(predicted - expected))) if len(X) else 0.0
+
+
+def _tree_depth(left, right):
+    """Number of edges on the longest path from the root to a leaf"""
+    depth, frontier = 0, [0]
+    while True:
+        children = [child for node in frontier for child in (left[node], right[node]) if child != -1]
+        if not children:
+            return depth
+        frontier = children
+        depth += 1
@@ -0,0 +1,161 @@
+"""
+Incremental aggregates of the delay dataset for the dashboard metrics.
+
+The counters behind the check-in type chart, the delay distribution, the late / on time / unknown
+summary and the impact on the next driver are kept per check-in type and per delay label, and
+updated with each new batch of rentals. The page renders from these few numbers, so its cost
+does not grow with the number of rentals, and a growing rental log only adds its new rows.
+A new version of the source whose former rows changed (delays filled in later for instance)
+is aggregated again from scratch.
+
+The aggregates shared across sessions are never modified once published: a new version of the
+source is aggregated into a new object, which then replaces the shared one.
+"""
+import hashlib
+import threading
+import numpy as np
+import pandas as pd
+import streamlit as st
+from cleaning import DELAY_LABELS, delay_category
+from data_loading import DATA_SOURCE, cached_source_version
+
+ON_TIME_LABEL = 0
+UNKNOWN_LABEL = len(DELAY_LABELS) - 1
+
+
+def rows_hash(rows):
+    """Bytes of the hash of each row, to check that rows did not change since they were aggregated"""
+    return pd.util.hash_pandas_object(rows, index=False).to_numpy().tobytes()
+
+
+class DelayAggregates:
+    """Counters of the delay dataset per check-in type, updated with append-only batches of rentals"""
+
+    def __init__(self, version=0):
+        # Number of batches added so far, changes whenever the aggregates do
+        self.version = version
+        self.n_rentals = 0
+        # Version of the source aggregated last, and digest of the rows aggregated so far
+        self.source_version = None
+        self._rows_digest = hashlib.sha1()
+        # Number of rentals per delay label, for each check-in type
+        self.delay_label_counts = {}
+        # Count, sum, min and max of the time delta with the previous rental of the late rentals
+        self.late_time_delta = {}
+
+    def update(self, batch):
+        """Adds a batch of cleaned rentals to the aggregates"""
+        if len(batch) == 0:
+            return
+        delays = batch['delay_at_checkout_in_minutes'].to_numpy(dtype=np.float64, na_value=np.nan)
+        labels = delay_category(delays).codes
+        time_deltas = batch['time_delta_with_previous_rental_in_minutes'].to_numpy(dtype=np.float64, na_value=np.nan)
+        checkin_types = batch['checkin_type'].astype(str).to_numpy()
+
+        for checkin_type in np.unique(checkin_types):
+            rows = checkin_types == checkin_type
+            counts = self.delay_label_counts.setdefault(checkin_type, np.zeros(len(DELAY_LABELS), dtype=np.int64))
+            counts += np.bincount(labels[rows], minlength=len(DELAY_LABELS))
+
+            late_time_deltas = time_deltas[rows & (delays > 0)]
+            late_time_deltas = late_time_deltas[~np.isnan(late_time_deltas)]
+            stats = self.late_time_delta.setdefault(checkin_type, {"count": 0, "sum": 0.0, "min": np.nan, "max": np.nan})
+            if len(late_time_deltas):
+                stats["count"] += len(late_time_deltas)
+                stats["sum"] += float(late_time_deltas.sum())
+                stats["min"] = float(np.fmin(stats["min"], late_time_deltas.min()))
+                stats["max"] = float(np.fmax(stats["max"], late_time_deltas.max()))
+
+        self.n_rentals += len(batch)
+        self._rows_digest.update(rows_hash(batch))
+        self.version += 1
+
+    def copy(self):
+        aggregates = DelayAggregates(self.version)
+        aggregates.n_rentals = self.n_rentals
+        aggregates.source_version = self.source_version
+        aggregates._rows_digest = self._rows_digest.copy()
+        aggregates.delay_label_counts = {name: counts.copy() for name, counts in self.delay_label_counts.items()}
+        aggregates.late_time_delta = {name: dict(stats) for name, stats in self.late_time_delta.items()}
+        return aggregates
+
+    def is_prefix_of(self, delay_data):
+        """Whether the rows aggregated so far are the first rows of `delay_data`, unchanged"""
+        if len(delay_data) < self.n_rentals:
+            return False
+        return hashlib.sha1(rows_hash(delay_data.iloc[:self.n_rentals])).hexdigest() == self._rows_digest.hexdigest()
+
+    def synced(self, delay_data, source_version=None):
+        """Aggregates of the whole dataset for a version of the source, leaving these ones unchanged.
+        Returns these aggregates when they are up to date, a copy with just the new rentals added
+        when the dataset only grew, and new aggregates of the whole dataset otherwise."""
+        if self.n_rentals > 0 and source_version == self.source_version and len(delay_data) == self.n_rentals:
+            return self
+        aggregates = self.copy() if self.is_prefix_of(delay_data) else DelayAggregates(self.version)
+        aggregates.update(delay_data.iloc[aggregates.n_rentals:])
+        aggregates.source_version = source_version
+        return aggregates
+
+    def _checkin_types(self, checkin_type):
+        return list(self.delay_label_counts) if checkin_type is None else [checkin_type]
+
+    def _label_counts(self, checkin_type):
+        counts = np.zeros(len(DELAY_LABELS), dtype=np.int64)
+        for name in self._checkin_types(checkin_type):
+            counts += self.delay_label_counts.get(name, 0)
+        return counts
+
+    def checkin_type_counts(self):
+        """Number of rentals per check-in type, most frequent first"""
+        counts = pd.Series({checkin_type: int(counts.sum()) for checkin_type, counts in self.delay_label_counts.items()},
+                           dtype='int64')
+        return counts.sort_values(ascending=False)
+
+    def delay_counts(self, checkin_type=None):
+        """Number of rentals per delay label (labels without rentals left out), most frequent first"""
+        counts = pd.Series(self._label_counts(checkin_type), index=DELAY_LABELS)
+        return counts[counts > 0].sort_values(ascending=False, kind='stable')
+
+    def summary(self, checkin_type=None):
+        """Total, late, on time or earlier and unknown returns"""
+        counts = self._label_counts(checkin_type)
+        return {
+            "total": int(counts.sum()),
+            "late": int(counts[ON_TIME_LABEL + 1:UNKNOWN_LABEL].sum()),
+            "on_time": int(counts[ON_TIME_LABEL]),
+            "unknown": int(counts[UNKNOWN_LABEL]),
+        }
+
+    def late_time_delta_stats(self, checkin_type=None):
+        """Mean, min and max time delta with the previous rental of the late rentals"""
+        stats = [self.late_time_delta[name] for name in self._checkin_types(checkin_type) if name in self.late_time_delta]
+        count = sum(s["count"] for s in stats)
+        return {
+            "mean": sum(s["sum"] for s in stats) / count if count else np.nan,
+            "min": min((s["min"] for s in stats if s["count"]), default=np.nan),
+            "max": max((s["max"] for s in stats if s["count"]), default=np.nan),
+        }
+
+
+class SharedDelayAggregates:
+    """The latest aggregates of a source, replaced as a whole when the source changes"""
+
+    def __init__(self):
+        self.aggregates = DelayAggregates()
+        self._lock = threading.Lock()
+
+    def sync(self, delay_data, source_version=None):
+        with self._lock:
+            self.aggregates = self.aggregates.synced(delay_data, source_version)
+            return self.aggregates
+
+
+@st.cache_resource(show_spinner=False)
+def shared_delay_aggregates(source):
+    return SharedDelayAggregates()
+
+
+def get_delay_aggregates(delay_data, source=DATA_SOURCE):
+    """Aggregates of the cleaned delay dataset, shared across sessions. When a new version of the
+    source only appends rentals, just those are added to the counters."""
+    return shared_delay_aggregates(source).sync(delay_data, cached_source_version(source))
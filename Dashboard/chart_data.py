@@ -0,0 +1,98 @@
+"""
+Chart data computed on the server, and a cache of the figures built from it.
+
+Histograms are binned with NumPy and sent to Plotly as bars, so the page only carries one
+value per bar instead of every row. Figures are cached on the data version, the chart name
+and its parameters: on a rerun, only the figures whose inputs changed are built again.
+Cached figures are shared between sessions and must not be modified after they are built.
+"""
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+import streamlit as st
+
+FIGURE_CACHE_SIZE = int(os.environ.get('FIGURE_CACHE_SIZE', 256))
+
+
+def histogram_counts(values, nbins=None):
+    """Bin edges and counts of the non-missing values, with NumPy's automatic bins by default"""
+    values = np.asarray(values, dtype=np.float64)
+    values = values[~np.isnan(values)]
+    if len(values) == 0:
+        return np.array([0.0, 1.0]), np.zeros(1, dtype=np.int64)
+    counts, edges = np.histogram(values, bins=nbins or 'auto')
+    return edges, counts
+
+
+def grouped_counts(x, color):
+    """Number of rows for each (x, color) pair, as a DataFrame with x values as index and color values as columns"""
+    x = pd.Categorical(x)
+    color = pd.Categorical(color)
+    valid = (x.codes >= 0) & (color.codes >= 0)
+    n_colors = len(color.categories)
+    counts = np.bincount(x.codes[valid].astype(np.int64) * n_colors + color.codes[valid],
+                         minlength=len(x.categories) * n_colors)
+    return pd.DataFrame(counts.reshape(len(x.categories), n_colors), index=x.categories, columns=color.categories)
+
+
+def histogram_figure(edges, counts, title, x_title, y_title='count'):
+    """Bars of pre-binned counts, drawn like a Plotly histogram"""
+    fig = go.Figure(go.Bar(
+        x=(edges[:-1] + edges[1:]) / 2,
+        y=counts,
+        width=np.diff(edges),
+        marker=dict(line=dict(width=0)),
+    ))
+    fig.update_layout(title=title, xaxis_title=x_title, yaxis_title=y_title, bargap=0)
+    return fig
+
+
+def stacked_bar_figure(counts, title, x_title, color_title, y_title='count'):
+    """Stacked bars of a grouped_counts DataFrame, one trace per column, empty columns left out"""
+    fig = go.Figure([
+        go.Bar(x=counts.index.astype(str), y=counts[column], name=str(column))
+        for column in counts.columns if counts[column].sum() > 0
+    ])
+    fig.update_layout(title=title, xaxis_title=x_title, yaxis_title=y_title, legend_title=color_title, barmode='stack')
+    return fig
+
+
+class FigureCache:
+    """LRU cache of figures (or of the data of a figure) keyed on the data version, the chart name and its parameters"""
+
+    def __init__(self, max_size=FIGURE_CACHE_SIZE):
+        self.max_size = max_size
+        self.figures = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get_or_build(self, data_version, name, params, build):
+        """Returns the cached figure, or calls `build()` and caches its result. `params` must be hashable."""
+        key = (data_version, name, params)
+        with self._lock:
+            figure = self.figures.get(key)
+            if figure is not None:
+                self.figures.move_to_end(key)
+                self.hits += 1
+                return figure
+            self.misses += 1
+
+        figure = build()
+        with self._lock:
+            self.figures[key] = figure
+            while len(self.figures) > self.max_size:
+                self.figures.popitem(last=False)
+        return figure
+
+    def stats(self):
+        return {"size": len(self.figures), "max_size": self.max_size, "hits": self.hits, "misses": self.misses}
+
+
+@st.cache_resource(show_spinner=False)
+def get_figure_cache():
+    """Figure cache shared across Streamlit reruns and sessions"""
+    return FigureCache()
@@ -0,0 +1,93 @@
+"""
+Loading of the delay dataset for the dashboard.
+
+The source (the S3 xlsx file by default, or a local file path) is converted once into a local
+Parquet snapshot, which is then memory-mapped on the next runs instead of downloading and
+parsing the Excel file again. The snapshot is rebuilt when the source changes: its
+modification time and size for a local file, its ETag / Last-Modified headers for a URL.
+When the source cannot be reached, the existing snapshot is used, so the dashboard also runs offline.
+"""
+import json
+import os
+import urllib.request
+import pandas as pd
+import streamlit as st
+
+DEFAULT_DATA_SOURCE = "https://full-stack-assets.s3.eu-west-3.amazonaws.com/Deployment/get_around_delay_analysis.xlsx"
+DATA_SOURCE = os.environ.get('DELAY_DATA_SOURCE', DEFAULT_DATA_SOURCE)
+SNAPSHOT_DIR = os.environ.get('DELAY_DATA_SNAPSHOT_DIR', '.data_snapshot')
+
+# How often (in seconds) the dashboard checks whether the source changed
+SOURCE_CHECK_INTERVAL = int(os.environ.get('DELAY_DATA_CHECK_INTERVAL', 300))
+
+
+def is_url(source):
+    return source.startswith(('http://', 'https://'))
+
+
+def source_version(source):
+    """Identifies the current version of the source, or returns None if it cannot be reached"""
+    if not is_url(source):
+        try:
+            stat = os.stat(source)
+        except FileNotFoundError:
+            return None
+        return f"{stat.st_mtime_ns}-{stat.st_size}"
+
+    try:
+        request = urllib.request.Request(source, method='HEAD')
+        with urllib.request.urlopen(request, timeout=5) as response:
+            headers = response.headers
+    except OSError:
+        return None
+    return headers.get('ETag') or headers.get('Last-Modified') or headers.get('Content-Length')
+
+
+def snapshot_paths(source, snapshot_dir=SNAPSHOT_DIR):
+    """Paths of the Parquet snapshot of a source and of its metadata file"""
+    name = os.path.splitext(os.path.basename(source.split('?')[0]))[0]
+    return os.path.join(snapshot_dir, name + '.parquet'), os.path.join(snapshot_dir, name + '.json')
+
+
+def read_source(source):
+    if source.endswith('.parquet'):
+        return pd.read_parquet(source)
+    if source.endswith('.csv'):
+        return pd.read_csv(source)
+    return pd.read_excel(source)
+
+
+def load_delay_data(source=DATA_SOURCE, version=None, snapshot_dir=SNAPSHOT_DIR):
+    """Returns the raw delay dataset, from the local snapshot when it matches `version`.
+    A `version` of None (source unreachable) accepts any existing snapshot."""
+    parquet_path, metadata_path = snapshot_paths(source, snapshot_dir)
+    if os.path.exists(parquet_path) and os.path.exists(metadata_path):
+        with open(metadata_path) as file:
+            snapshot_version = json.load(file).get('version')
+        if version is None or version == snapshot_version:
+            return pd.read_parquet(parquet_path, memory_map=True)
+
+    delay_data = read_source(source)
+
+    # Write the snapshot next to its final location first, so a crash never leaves a partial file
+    os.makedirs(snapshot_dir, exist_ok=True)
+    delay_data.to_parquet(parquet_path + '.tmp', index=False)
+    os.replace(parquet_path + '.tmp', parquet_path)
+    with open(metadata_path, 'w') as file:
+        json.dump({"source": source, "version": version}, file)
+    return delay_data
+
+
+@st.cache_data(ttl=SOURCE_CHECK_INTERVAL, show_spinner=False)
+def cached_source_version(source):
+    return source_version(source)
+
+
+@st.cache_data(max_entries=2, show_spinner="Loading delay data...")
+def cached_delay_data(source, version):
+    return load_delay_data(source, version)
+
+
+def get_delay_data(source=DATA_SOURCE):
+    """Raw delay dataset, memoized across Streamlit reruns and refreshed when the source changes"""
+    return cached_delay_data(source, cached_source_version(source))
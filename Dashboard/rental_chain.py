@@ -0,0 +1,166 @@
+"""
+Links each rental to the previous rental of the same car through an integer index.
+
+Rental ids are kept sorted along with their row positions, so finding the row of any number of
+rental ids is one `np.searchsorted`, and the values of the previous rentals are read with `take`
+instead of a hash merge of the whole dataset. Rentals can be appended in batches: only the new
+rows, and the older rows whose previous rental just arrived, are linked and recomputed.
+
+Run it as a script to check the index against the merge-based computation:
+    python rental_chain.py [source]
+"""
+import sys
+import numpy as np
+import streamlit as st
+from cleaning import cached_clean_delay_data, clean_delay_data
+from data_loading import DATA_SOURCE, cached_source_version, load_delay_data, source_version
+
+NO_ROW = -1
+
+
+def rental_ids(series):
+    """Integer rental ids of a column (nullable integers, floats or numeric strings), -1 when missing"""
+    values = series.astype('float64').to_numpy(dtype=np.float64, na_value=np.nan)
+    return np.where(np.isnan(values), NO_ROW, values).astype(np.int64)
+
+
+class RentalChain:
+    """Rental id to row position index of the delay dataset, with the link of every row to the
+    row of its previous rental (`previous_position`, -1 when it is not in the dataset)"""
+
+    def __init__(self, delay_data=None):
+        self.rental_id = np.empty(0, dtype=np.int64)
+        self.previous_rental_id = np.empty(0, dtype=np.int64)
+        self.delay = np.empty(0, dtype=np.float64)
+        self.time_delta = np.empty(0, dtype=np.float64)
+        self.previous_position = np.empty(0, dtype=np.int64)
+        # Time between the previous checkout and this check-in minus this rental's checkout delay,
+        # NaN for the rentals not linked to a previous one
+        self.delta_previous_and_delay = np.empty(0, dtype=np.float64)
+        # Checkout delay of the previous rental, NaN for the rentals not linked to a previous one
+        self.previous_delay = np.empty(0, dtype=np.float64)
+        self._sorted_ids = np.empty(0, dtype=np.int64)
+        self._sorted_positions = np.empty(0, dtype=np.int64)
+        # Rows whose previous rental is not in the dataset yet
+        self._pending = np.empty(0, dtype=np.int64)
+        if delay_data is not None:
+            self.append(delay_data)
+
+    def __len__(self):
+        return len(self.rental_id)
+
+    def positions(self, ids):
+        """Row position of each rental id, -1 for the ids that are not in the dataset"""
+        ids = np.asarray(ids, dtype=np.int64)
+        if len(self._sorted_ids) == 0:
+            return np.full(len(ids), NO_ROW, dtype=np.int64)
+        index = np.minimum(np.searchsorted(self._sorted_ids, ids), len(self._sorted_ids) - 1)
+        found = (self._sorted_ids.take(index) == ids) & (ids != NO_ROW)
+        return np.where(found, self._sorted_positions.take(index), NO_ROW)
+
+    def append(self, rows):
+        """Adds a batch of rentals (in the order of the delay dataset rows) and links them.
+        Returns the positions of the rows whose link was created by this batch."""
+        new_ids = rental_ids(rows['rental_id'])
+        start = len(self)
+        new_positions = np.arange(start, start + len(new_ids), dtype=np.int64)
+
+        # Insert the new ids into the sorted index, rejecting the ids seen before
+        order = np.argsort(new_ids, kind='stable')
+        sorted_new_ids = new_ids[order]
+        if np.any(np.diff(sorted_new_ids) == 0) or np.any(self.positions(sorted_new_ids) != NO_ROW):
+            raise ValueError("Rental ids must be unique")
+        insert_at = np.searchsorted(self._sorted_ids, sorted_new_ids)
+        self._sorted_ids = np.insert(self._sorted_ids, insert_at, sorted_new_ids)
+        self._sorted_positions = np.insert(self._sorted_positions, insert_at, new_positions[order])
+
+        self.rental_id = np.concatenate([self.rental_id, new_ids])
+        self.previous_rental_id = np.concatenate([self.previous_rental_id, rental_ids(rows['previous_ended_rental_id'])])
+        self.delay = np.concatenate([self.delay, rows['delay_at_checkout_in_minutes'].to_numpy(dtype=np.float64, na_value=np.nan)])
+        self.time_delta = np.concatenate([
+            self.time_delta, rows['time_delta_with_previous_rental_in_minutes'].to_numpy(dtype=np.float64, na_value=np.nan)
+        ])
+        self.previous_position = np.concatenate([self.previous_position, np.full(len(new_ids), NO_ROW, dtype=np.int64)])
+        self.delta_previous_and_delay = np.concatenate([self.delta_previous_and_delay, np.full(len(new_ids), np.nan)])
+        self.previous_delay = np.concatenate([self.previous_delay, np.full(len(new_ids), np.nan)])
+
+        # Link the new rows and the older rows that were waiting for their previous rental
+        candidates = np.concatenate([self._pending, new_positions[self.previous_rental_id[new_positions] != NO_ROW]])
+        previous = self.positions(self.previous_rental_id[candidates])
+        linked = candidates[previous != NO_ROW]
+        self._pending = candidates[previous == NO_ROW]
+        self.previous_position[linked] = previous[previous != NO_ROW]
+        self._update(linked)
+        return linked
+
+    def _update(self, positions):
+        """Recomputes the chain metrics of the given rows"""
+        self.delta_previous_and_delay[positions] = self.time_delta[positions] - self.delay[positions]
+        self.previous_delay[positions] = self.delay.take(self.previous_position[positions])
+
+    @property
+    def linked(self):
+        """Whether the previous rental of each row is in the dataset"""
+        return self.previous_position != NO_ROW
+
+    def problematic(self):
+        """Rows returned later than the time planned before the next check-in"""
+        return self.delta_previous_and_delay < 0
+
+
+@st.cache_resource(max_entries=2, show_spinner=False)
+def cached_rental_chain(source, version):
+    return RentalChain(cached_clean_delay_data(source, version))
+
+
+def get_rental_chain(source=DATA_SOURCE):
+    """Rental chain of the cleaned delay dataset, shared across Streamlit reruns and sessions"""
+    return cached_rental_chain(source, cached_source_version(source))
+
+
+@st.cache_resource(max_entries=2, show_spinner=False)
+def cached_problematic_rentals(source, version):
+    chain = cached_rental_chain(source, version)
+    problematic = chain.problematic()
+    return cached_clean_delay_data(source, version)[problematic].assign(
+        delta_previous_and_delay=chain.delta_previous_and_delay[problematic]
+    )
+
+
+def get_problematic_rentals(source=DATA_SOURCE):
+    """Rentals returned later than the next check-in, with their 'delta_previous_and_delay',
+    selected once per version of the source"""
+    return cached_problematic_rentals(source, cached_source_version(source))
+
+
+def check_against_merge(delay_data, n_batches=5, seed=0):
+    """Compares the chain, built at once and from shuffled batches, with the former merge on
+    `previous_ended_rental_id`. Raises an AssertionError on any difference."""
+    merged = delay_data.merge(delay_data[['rental_id']], left_on='previous_ended_rental_id', right_on='rental_id', how='inner')
+    expected_ids = rental_ids(merged['rental_id_x'])
+    expected_delta = (merged['time_delta_with_previous_rental_in_minutes']
+                      - merged['delay_at_checkout_in_minutes']).to_numpy(dtype=np.float64, na_value=np.nan)
+
+    shuffled = delay_data.sample(frac=1, random_state=seed)
+    incremental_chain = RentalChain()
+    for batch in np.array_split(np.arange(len(shuffled)), n_batches):
+        incremental_chain.append(shuffled.iloc[batch])
+
+    for chain in (RentalChain(delay_data), incremental_chain):
+        positions = chain.positions(expected_ids)
+        assert chain.linked.sum() == len(merged), "The chain does not link the same rentals as the merge"
+        assert np.all(chain.linked[positions]), "The chain does not link the same rentals as the merge"
+        assert np.allclose(chain.delta_previous_and_delay[positions], expected_delta, equal_nan=True), \
+            "delta_previous_and_delay differs from the merge"
+        assert chain.problematic().sum() == (expected_delta < 0).sum()
+    return {"rentals": len(delay_data), "linked": len(merged), "problematic": int((expected_delta < 0).sum())}
+
+
+def main():
+    source = sys.argv[1] if len(sys.argv) > 1 else DATA_SOURCE
+    delay_data = clean_delay_data(load_delay_data(source, source_version(source)))
+    print(f"The rental chain matches the merge: {check_against_merge(delay_data)}")
+
+
+if __name__ == "__main__":
+    main()
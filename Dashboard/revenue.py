@@ -0,0 +1,81 @@
+"""
+Estimated revenue of the rentals that a minimum delay between two rentals would have blocked.
+
+The rental price per day of each car comes from the pricing model, scored offline over the fleet
+by `API/score_cars.py` into a car_id -> rental_price_per_day CSV file. Cars without a scored
+price are counted at an average price. Each blocked rental is counted as one day of rental.
+
+The time deltas with the previous rental are sorted once per check-in type along with the cumulative
+sum of the matching prices, so the revenue blocked by any number of thresholds is one `np.searchsorted`.
+"""
+import os
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+import streamlit as st
+from data_loading import cached_source_version
+from thresholds import TIME_DELTA_COLUMN
+
+CAR_PRICES_PATH = os.environ.get('CAR_PRICES_PATH', 'car_prices.csv')
+# Average rental price per day in the pricing dataset the model was trained on
+DEFAULT_RENTAL_PRICE = float(os.environ.get('DEFAULT_RENTAL_PRICE', 121))
+
+
+def load_car_prices(path=CAR_PRICES_PATH):
+    """Rental price per day indexed by car_id, or None when the prices were not scored"""
+    if not os.path.exists(path):
+        return None
+    prices = pd.read_csv(path, usecols=['car_id', 'rental_price_per_day'])
+    return prices.drop_duplicates('car_id').set_index('car_id')['rental_price_per_day']
+
+
+class RevenueImpact:
+    """Revenue of the rentals booked less than a threshold after the previous rental of the car"""
+
+    def __init__(self, delay_data, car_prices=None, default_price=DEFAULT_RENTAL_PRICE):
+        car_ids = delay_data['car_id'].astype('float64').to_numpy(dtype=np.float64, na_value=np.nan)
+        if car_prices is None:
+            prices = np.full(len(car_ids), np.nan)
+        else:
+            prices = car_prices.reindex(car_ids).to_numpy(dtype=np.float64)
+        # Share of the rentals priced with the model rather than the default price
+        self.priced_share = float(np.mean(~np.isnan(prices)) * 100) if len(prices) else 0.0
+        prices = np.where(np.isnan(prices), default_price, prices)
+
+        time_deltas = delay_data[TIME_DELTA_COLUMN].to_numpy(dtype=np.float64, na_value=np.nan)
+        checkin_types = delay_data['checkin_type'].astype(str).to_numpy()
+        self.time_deltas, self.cumulative_revenue = {}, {}
+        for checkin_type in [None] + list(np.unique(checkin_types)):
+            rows = ~np.isnan(time_deltas)
+            if checkin_type is not None:
+                rows &= checkin_types == checkin_type
+            order = np.argsort(time_deltas[rows], kind='stable')
+            self.time_deltas[checkin_type] = time_deltas[rows][order]
+            self.cumulative_revenue[checkin_type] = np.concatenate([[0.0], np.cumsum(prices[rows][order])])
+
+    def revenue_loss(self, thresholds, checkin_type=None):
+        """Revenue of the rentals that a minimum delay of each threshold would have blocked"""
+        if checkin_type not in self.time_deltas:
+            return np.zeros(len(thresholds))
+        blocked = np.searchsorted(self.time_deltas[checkin_type], np.asarray(thresholds), side='left')
+        return self.cumulative_revenue[checkin_type][blocked]
+
+
+@st.cache_resource(max_entries=2, show_spinner=False)
+def cached_revenue_impact(_delay_data, data_version, prices_path, prices_version):
+    return RevenueImpact(_delay_data, load_car_prices(prices_path))
+
+
+def get_revenue_impact(delay_data, data_version, prices_path=CAR_PRICES_PATH):
+    """Revenue impact of the cleaned delay dataset, rebuilt when the data or the car prices change"""
+    return cached_revenue_impact(delay_data, data_version, prices_path, cached_source_version(prices_path))
+
+
+def add_revenue_loss(fig, thresholds, revenue_loss):
+    """Adds the estimated revenue loss of each threshold to a threshold curve, on a second y axis"""
+    fig.update_traces(name='Problematic delays', showlegend=True)
+    fig.add_trace(go.Scatter(x=thresholds, y=revenue_loss, mode='lines+markers', yaxis='y2',
+                             name='Estimated revenue loss (€)'))
+    fig.update_layout(yaxis2=dict(title='Estimated Revenue Loss (€)', overlaying='y', side='right', rangemode='tozero'),
+                      legend=dict(orientation='h', y=-0.2))
+    return fig
@@ -1,37 +1,21 @@
 # Import necessary libraries
 import streamlit as st
-import pandas as pd
 import numpy as np
 import plotly.express as px
 import plotly.graph_objects as go
 import os
+from aggregates import get_delay_aggregates
+from chart_data import get_figure_cache, grouped_counts, histogram_counts, histogram_figure, stacked_bar_figure
+from cleaning import get_clean_delay_data
+from data_loading import DATA_SOURCE, cached_source_version
+from rental_chain import get_problematic_rentals
+from revenue import DEFAULT_RENTAL_PRICE, add_revenue_loss, get_revenue_impact
+from thresholds import get_threshold_analyzer
+from what_if import cached_threshold_grid, threshold_grid
 
 # Get the port from the environment variable or use a default (e.g., 8080)
 port = int(os.environ.get('PORT', 8080))
 
-# Load the data from the provided S3 bucket URL
-data_url = "https://full-stack-assets.s3.eu-west-3.amazonaws.com/Deployment/get_around_delay_analysis.xlsx"
-delay_data = pd.read_excel(data_url)
-
-# Perform data cleaning
-delay_data['rental_id'] = delay_data['rental_id'].astype(str)
-delay_data['car_id'] = delay_data['car_id'].astype(str)
-delay_data['previous_ended_rental_id'] = delay_data['previous_ended_rental_id'].apply(
-    lambda x: str(int(x)) if not pd.isna(x) else x
-)
-conditions = [
-    (delay_data['delay_at_checkout_in_minutes'] <= 0),
-    (delay_data['delay_at_checkout_in_minutes'] < 60),
-    (delay_data['delay_at_checkout_in_minutes'] < 120),
-    (delay_data['delay_at_checkout_in_minutes'] < 300),
-    (delay_data['delay_at_checkout_in_minutes'] < 1440),
-    (delay_data['delay_at_checkout_in_minutes'] >= 1440),
-    (delay_data['delay_at_checkout_in_minutes'].isna())
-]
-
-labels = ['Early or On Time', '< 1 Hour', '1 to 2 Hours', '2 to 5 Hours', '5 to 24 Hours', '1 day or more', 'Unknown']
-delay_data['delay'] = np.select(conditions, labels)
-
 # STREAMLIT PAGE
 
 st.set_page_config(
@@ -39,6 +23,18 @@ st.set_page_config(
     page_icon="📊",
     layout="wide"
   )
+
+# Load the data from the S3 bucket (or DELAY_DATA_SOURCE) through a local Parquet snapshot, and clean it
+delay_data = get_clean_delay_data()
+
+# Counters behind the metrics below, only the new rentals are added when the dataset grows
+delay_aggregates = get_delay_aggregates(delay_data)
+
+# Figures are cached on the data version and their parameters, only the ones whose inputs changed are rebuilt.
+# The data version is the version of the source, which the cleaned data and the rental chain are cached on too.
+figure_cache = get_figure_cache()
+data_version = cached_source_version(DATA_SOURCE)
+
 st.title("Getaround: Delay Analysis Dashboard 📊")
 
 st.write("Welcome to this dashboard ! Our goal is to help you to make strategic decisions about how to deal with late returns.")
@@ -52,7 +48,7 @@ st.dataframe(delay_data.head())
 st.subheader("Check-in Type Visualization")
 
     # Create a bar chart to visualize check-in type
-checkin_type_counts = delay_data['checkin_type'].value_counts()
+checkin_type_counts = delay_aggregates.checkin_type_counts()
 checkin_type_percentage = (checkin_type_counts / checkin_type_counts.sum()) * 100
 
 fig1 = px.bar(
@@ -77,10 +73,11 @@ st.subheader("How often are drivers late for the next check-in?")
 
 # Build summary table
     # Calculate the number of total entries, late returns, on-time returns, and NaN
-total_entries = len(delay_data)
-late_returns_count = len(delay_data[delay_data['delay_at_checkout_in_minutes'] > 0])
-nan_count = delay_data['delay_at_checkout_in_minutes'].isna().sum()
-on_time_or_earlier_count = len(delay_data[delay_data['delay_at_checkout_in_minutes'] <= 0])
+delay_summary = delay_aggregates.summary()
+total_entries = delay_summary['total']
+late_returns_count = delay_summary['late']
+nan_count = delay_summary['unknown']
+on_time_or_earlier_count = delay_summary['on_time']
 
     # Calculate percentage for each category
 late_return_percentage = (late_returns_count / total_entries) * 100
@@ -105,7 +102,7 @@ st.write(formatted_text)
 
 # Histogram of delay distribution
     # Calculate the counts and percentages of each delay category
-delay_counts = delay_data['delay'].value_counts()
+delay_counts = delay_aggregates.delay_counts()
 delay_percentages = (delay_counts / delay_counts.sum()) * 100
 
     # Create a histogram manually
@@ -133,122 +130,98 @@ st.plotly_chart(fig2)
 st.subheader("How does it impact the next driver ?")
 
 # Calculate the frequency of late check-ins
-late_checkins = delay_data[delay_data['delay_at_checkout_in_minutes'] > 0]
-late_checkin_frequency = (len(late_checkins) / len(delay_data)) * 100
+late_checkin_frequency = (late_returns_count / total_entries) * 100
 st.write("<u>Frequency of late check-ins</u>",unsafe_allow_html=True)
 st.write("Percentage of late check-ins:", f"{late_checkin_frequency:.2f}%")
 
 # Analyze the impact on the next driver
-average_delay = late_checkins['time_delta_with_previous_rental_in_minutes'].mean()
-max_delay = late_checkins['time_delta_with_previous_rental_in_minutes'].max()
-min_delay = late_checkins['time_delta_with_previous_rental_in_minutes'].min()
+late_time_delta_stats = delay_aggregates.late_time_delta_stats()
+average_delay = late_time_delta_stats['mean']
+max_delay = late_time_delta_stats['max']
+min_delay = late_time_delta_stats['min']
 
 st.write("<u>Impact on the next driver </u>",unsafe_allow_html=True)
 st.write(f"""Average delay in minutes for the next driver: {average_delay:.2f} minutes  
         Maximum delay in minutes for the next driver: {max_delay} minutes  
         Minimum delay in minutes for the next driver: {min_delay} minutes""")
 
-# Create a new DataFrame 'test_df' by merging on 'previous_ended_rental_id'
-merge_id_df = delay_data.merge(
-    delay_data[['rental_id']],
-    left_on='previous_ended_rental_id',
-    right_on='rental_id',
-    how='inner'
-)
-
-# Calculate the new column 'delta_previous_and_delay'
-merge_id_df['delta_previous_and_delay'] = merge_id_df['time_delta_with_previous_rental_in_minutes'] - merge_id_df['delay_at_checkout_in_minutes']
-
-# Select rows where 'delta_previous_and_delay' values are strictly negative
-negative_delta_rows = merge_id_df[merge_id_df['delta_previous_and_delay'] < 0]
+# Select rows where 'delta_previous_and_delay' values are strictly negative, linking each rental
+# to its previous rental through the rental id index (once per version of the data)
+negative_delta_rows = get_problematic_rentals()
 
 # Calculate the percentage of problematic delays among all the delays
-nb_late_checkins = len(late_checkins)
+nb_late_checkins = late_returns_count
 nb_problematic_delays = negative_delta_rows.shape[0]
 problematic_delays_rate = nb_problematic_delays * 100 / nb_late_checkins
 
 st.write(f"Among all the delays, **{round(problematic_delays_rate, 2)}%** of delays caused problems to the next rental because the checkout was made later than the new rental check-in.")
 
+# Sort the delays once per version of the data to answer every threshold question below with binary searches
+threshold_analyzer = get_threshold_analyzer()
+
 # Create a histogram for problematic delays
 st.subheader("Distribution of Problematic Delays by Delay Duration")
-fig3 = px.histogram(data_frame=negative_delta_rows, x='delay_at_checkout_in_minutes',
-                   title='Distribution of Problematic Delays by Delay Duration')
+    # Bin the delays on the server so that only the bars are sent to the browser
+fig3 = figure_cache.get_or_build(data_version, 'problematic_delays_histogram', (), lambda: histogram_figure(
+    *histogram_counts(negative_delta_rows['delay_at_checkout_in_minutes']),
+    title='Distribution of Problematic Delays by Delay Duration', x_title='delay_at_checkout_in_minutes'))
 st.plotly_chart(fig3)
 
 # Create a time-based histogram for check-in times
 st.subheader("Distribution of Check-in Types by Delay Category")
-fig4 = px.histogram(data_frame=negative_delta_rows, x='checkin_type', color='delay',
-                   title='Distribution of Check-in Types by Delay Category')
+fig4 = figure_cache.get_or_build(data_version, 'problematic_checkin_types', (), lambda: stacked_bar_figure(
+    grouped_counts(negative_delta_rows['checkin_type'], negative_delta_rows['delay']),
+    title='Distribution of Check-in Types by Delay Category', x_title='checkin_type', color_title='delay'))
 st.plotly_chart(fig4)
 st.write("The worst delays concern the rentals made through the **web application**.")
 
 # Sub-section 3 : Threshold - How long should the minimum delay be?
 st.subheader("Threshold - How long should the minimum delay be?")
 
+# Estimated revenue of the rentals each threshold would block, from the car prices scored with the pricing model
+revenue_impact = get_revenue_impact(delay_data, data_version)
+st.write(f"The estimated revenue loss counts one day of rental at the price predicted by the pricing model for each rental the threshold would have blocked "
+         f"({revenue_impact.priced_share:.2f}% of the rentals have a predicted price, the others are counted at {DEFAULT_RENTAL_PRICE:.0f}€ per day).")
+
 # Define different delay thresholds (in minutes)
 thresholds = [60, 90, 120, 150, 180, 210, 240, 300, 360, 420, 480, 600, 720, 1440]  # Define different delay thresholds (in minutes)
-problematic_rates = []
-
-for threshold in thresholds:
-    # Filter data for delays exceeding the threshold
-    delayed_rentals = delay_data[delay_data['delay_at_checkout_in_minutes'] > threshold]
 
-    # Calculate the percentage of problematic delays for each threshold
-    problematic_rate = (len(delayed_rentals) / len(delay_data)) * 100
-    problematic_rates.append(problematic_rate)
+# Calculate the percentage of rentals returned later than each threshold
+problematic_rates = threshold_analyzer.share_above(thresholds)
 
 # Create a line plot to visualize the impact of different thresholds
 fig5 = px.line(x=thresholds, y=problematic_rates, markers=True, title='Impact of Delay Threshold on Problematic Delays')
 fig5.update_layout(xaxis_title='Delay Threshold (minutes)', yaxis_title='Percentage of Problematic Delays')
+add_revenue_loss(fig5, thresholds, revenue_impact.revenue_loss(thresholds))
 st.plotly_chart(fig5)
 
 st.write("According to this graph, the threshold should be set at **300 minutes** (5 hours) so that we hope to get less than **5%** of problematic delays.")
 
-# Filter data for 'mobile' check-ins
-mobile_checkins = delay_data[delay_data['checkin_type'] == 'mobile']
-
 # Define different delay thresholds (in minutes)
 thresholds = [60, 90, 120, 150, 180, 210, 240, 300, 360, 420, 480, 600, 720, 800, 900, 950, 1000, 1200, 1440]
 
-# Initialize a list to store problematic rates for 'mobile' check-ins
-mobile_problematic_rates = []
-
-for threshold in thresholds:
-    # Filter 'mobile' check-ins for delays exceeding the threshold
-    delayed_mobile_checkins = mobile_checkins[mobile_checkins['delay_at_checkout_in_minutes'] > threshold]
-
-    # Calculate the percentage of problematic delays for each threshold and 'mobile' check-ins
-    mobile_problematic_rate = (len(delayed_mobile_checkins) / len(mobile_checkins)) * 100
-    mobile_problematic_rates.append(mobile_problematic_rate)
+# Calculate the percentage of 'mobile' check-ins returned later than each threshold
+mobile_problematic_rates = threshold_analyzer.share_above(thresholds, 'mobile')
 
 # Create a line plot to visualize the impact of different thresholds for 'mobile' check-ins
 fig6 = px.line(x=thresholds, y=mobile_problematic_rates, markers=True, title='Impact of Delay Threshold on Problematic Delays for Mobile Check-ins')
 fig6.update_layout(xaxis_title='Delay Threshold (minutes)', yaxis_title='Percentage of Problematic Delays')
+add_revenue_loss(fig6, thresholds, revenue_impact.revenue_loss(thresholds, 'mobile'))
 st.plotly_chart(fig6)
 
 st.write("For *mobile check-in*, the most adapted threshold to get *less than 2% problematic delays* seems to be **950 minutes** (more than 15 hours).")
 st.write("If we aim to get less than *5% problematic delays*, then the best threshold seems to be **360 minutes** (6 hours).")
 
-# Filter data for 'connect' check-ins
-connect_checkins = delay_data[delay_data['checkin_type'] == 'connect']
-
 # Define different delay thresholds (in minutes)
 thresholds = [60, 90, 120, 130, 140, 150, 180, 210, 240, 300, 360]
 
-# Initialize a list to store problematic rates for 'connect' check-ins
-connect_problematic_rates = []
-
-for threshold in thresholds:
-    # Filter 'connect' check-ins for delays exceeding the threshold
-    delayed_connect_checkins = connect_checkins[connect_checkins['delay_at_checkout_in_minutes'] > threshold]
-
-    # Calculate the percentage of problematic delays for each threshold and 'connect' check-ins
-    connect_problematic_rate = (len(delayed_connect_checkins) / len(connect_checkins)) * 100
-    connect_problematic_rates.append(connect_problematic_rate)
+# Calculate the percentage of 'connect' check-ins returned later than each threshold
+connect_problematic_rates = threshold_analyzer.share_above(thresholds, 'connect')
 
 # Create a line plot to visualize the impact of different thresholds for 'connect' check-ins
 fig7 = px.line(x=thresholds, y=connect_problematic_rates, markers=True, title='Impact of Delay Threshold on Problematic Delays for Connect Check-ins')
 fig7.update_layout(xaxis_title='Delay Threshold (minutes)', yaxis_title='Percentage of Problematic Delays')
+add_revenue_loss(fig7, thresholds, revenue_impact.revenue_loss(thresholds, 'connect'))
 st.plotly_chart(fig7)
 
 st.write("On the other hand, for *connect check-in*, the best threshold to get *less than 2% of problematic delays* seems to be **250 minutes** (a bit more than 4 hours), so much less than the mobile check-ins. If we aim to get less than *5% problematic delays*, the threshold should be set at **150 minutes** (2,5 hours).")
@@ -264,26 +237,13 @@ st.subheader("How many problematic cases will it solve depending on the chosen t
 threshold_mobile_5 = 360  # Minutes for mobile check-ins
 threshold_connect_5 = 150  # Minutes for connect check-ins
 
-# Filter data for 'mobile' check-ins with delays below or equal to the threshold
-solved_mobile_checkins_5 = negative_delta_rows[
-    (negative_delta_rows['checkin_type'] == 'mobile') &
-    (negative_delta_rows['delay_at_checkout_in_minutes'] <= threshold_mobile_5)]
-
-# Filter data for 'connect' check-ins with delays below or equal to the threshold
-solved_connect_checkins_5 = negative_delta_rows[
-    (negative_delta_rows['checkin_type'] == 'connect') &
-    (negative_delta_rows['delay_at_checkout_in_minutes'] <= threshold_connect_5)]
-
-# Calculate the number of problematic delays solved for each check-ins
-solved_mobile_problems_5 = len(solved_mobile_checkins_5)
-solved_connect_problems_5 = len(solved_connect_checkins_5)
+# Calculate the number of problematic delays below or equal to the threshold for each check-in type
+solved_mobile_problems_5 = threshold_analyzer.solved_count([threshold_mobile_5], 'mobile')[0]
+solved_connect_problems_5 = threshold_analyzer.solved_count([threshold_connect_5], 'connect')[0]
 
 # Calculate the percentage of problematic delays solved for each check-in type
-total_mobile_problems_5 = len(negative_delta_rows[negative_delta_rows['checkin_type'] == 'mobile'])
-total_connect_problems_5 = len(negative_delta_rows[negative_delta_rows['checkin_type'] == 'connect'])
-
-percentage_solved_mobile_5 = (solved_mobile_problems_5 / total_mobile_problems_5) * 100
-percentage_solved_connect_5 = (solved_connect_problems_5 / total_connect_problems_5) * 100
+percentage_solved_mobile_5 = threshold_analyzer.solved_share([threshold_mobile_5], 'mobile')[0]
+percentage_solved_connect_5 = threshold_analyzer.solved_share([threshold_connect_5], 'connect')[0]
 
 st.write("<u>Chosen Thresholds for 5% Risk:</u>",unsafe_allow_html=True)
 st.write(f"""Threshold for Mobile Check-ins: {threshold_mobile_5} minutes  
@@ -300,26 +260,13 @@ st.write(f"""Percentage of problematic delays solved for mobile check-ins: {roun
 threshold_mobile_2 = 950  # Minutes for mobile check-ins
 threshold_connect_2 = 250  # Minutes for connect check-ins
 
-# Filter data for 'mobile' check-ins with delays below or equal to the threshold
-solved_mobile_checkins_2 = negative_delta_rows[
-    (negative_delta_rows['checkin_type'] == 'mobile') &
-    (negative_delta_rows['delay_at_checkout_in_minutes'] <= threshold_mobile_2)]
-
-# Filter data for 'connect' check-ins with delays below or equal to the threshold
-solved_connect_checkins_2 = negative_delta_rows[
-    (negative_delta_rows['checkin_type'] == 'connect') &
-    (negative_delta_rows['delay_at_checkout_in_minutes'] <= threshold_connect_2)]
-
-# Calculate the number of problematic delays solved for each check-ins
-solved_mobile_problems_2 = len(solved_mobile_checkins_2)
-solved_connect_problems_2 = len(solved_connect_checkins_2)
+# Calculate the number of problematic delays below or equal to the threshold for each check-in type
+solved_mobile_problems_2 = threshold_analyzer.solved_count([threshold_mobile_2], 'mobile')[0]
+solved_connect_problems_2 = threshold_analyzer.solved_count([threshold_connect_2], 'connect')[0]
 
 # Calculate the percentage of problematic delays solved for each check-in type
-total_mobile_problems_2 = len(negative_delta_rows[negative_delta_rows['checkin_type'] == 'mobile'])
-total_connect_problems_2 = len(negative_delta_rows[negative_delta_rows['checkin_type'] == 'connect'])
-
-percentage_solved_mobile_2 = (solved_mobile_problems_2 / total_mobile_problems_2) * 100
-percentage_solved_connect_2 = (solved_connect_problems_2 / total_connect_problems_2) * 100
+percentage_solved_mobile_2 = threshold_analyzer.solved_share([threshold_mobile_2], 'mobile')[0]
+percentage_solved_connect_2 = threshold_analyzer.solved_share([threshold_connect_2], 'connect')[0]
 
 st.write("<u>Chosen Thresholds for 2% Risk:</u>",unsafe_allow_html=True)
 st.write(f"""Threshold for Mobile Check-ins: {threshold_mobile_2} minutes  
@@ -332,9 +279,79 @@ st.write(f"""Number of problematic delays solved for mobile check-ins: {solved_m
 st.write(f"""Percentage of problematic delays solved for mobile check-ins: {round(percentage_solved_mobile_2, 2)}%  
          Percentage of problematic delays solved for connect check-ins: {round(percentage_solved_connect_2, 2)}%""")
 
+# Let the user try any pair of thresholds, every minute from 0 to 24 hours is evaluated at once
+st.write("<u>Choose your own thresholds:</u>",unsafe_allow_html=True)
+threshold_mobile = st.slider("Threshold for mobile check-ins (minutes)", min_value=0, max_value=1440, value=threshold_mobile_5)
+threshold_connect = st.slider("Threshold for connect check-ins (minutes)", min_value=0, max_value=1440, value=threshold_connect_5)
+
+def threshold_sweep_curves():
+    sweep_thresholds = np.arange(0, 1441)
+    return sweep_thresholds, {checkin_type: threshold_analyzer.solved_share(sweep_thresholds, checkin_type)
+                              for checkin_type in ('mobile', 'connect')}
+
+# The curves only depend on the data and are cached once per data version, the slider moves only change the markers.
+# Rebuilding the figure around the cached curves is faster than copying a cached figure to add the markers to it.
+sweep_thresholds, solved_shares = figure_cache.get_or_build(data_version, 'threshold_sweep_curves', (), threshold_sweep_curves)
+fig_sweep = go.Figure()
+for checkin_type, chosen_threshold in (('mobile', threshold_mobile), ('connect', threshold_connect)):
+    fig_sweep.add_trace(go.Scatter(x=sweep_thresholds, y=solved_shares[checkin_type], mode='lines', name=checkin_type))
+    fig_sweep.add_trace(go.Scatter(x=[chosen_threshold], y=[solved_shares[checkin_type][chosen_threshold]], mode='markers',
+                                   marker=dict(size=10), name=f'{checkin_type} threshold'))
+fig_sweep.update_layout(title='Percentage of Problematic Delays Solved by Threshold',
+                        xaxis_title='Delay Threshold (minutes)', yaxis_title='Percentage of Problematic Delays Solved')
+st.plotly_chart(fig_sweep)
+
+st.write(f"""Percentage of problematic delays solved for mobile check-ins: {threshold_analyzer.solved_share([threshold_mobile], 'mobile')[0]:.2f}%  
+         Percentage of problematic delays solved for connect check-ins: {threshold_analyzer.solved_share([threshold_connect], 'connect')[0]:.2f}%  
+         Percentage of mobile check-ins returned later than the threshold: {threshold_analyzer.share_above([threshold_mobile], 'mobile')[0]:.2f}%  
+         Percentage of connect check-ins returned later than the threshold: {threshold_analyzer.share_above([threshold_connect], 'connect')[0]:.2f}%  
+         Estimated revenue loss: {revenue_impact.revenue_loss([threshold_mobile], 'mobile')[0] + revenue_impact.revenue_loss([threshold_connect], 'connect')[0]:,.0f}€""")
+
 st.write("**<u>Conclusion</u>**",unsafe_allow_html=True)
 st.write("Results are better with thresholds set to minimize problematic delay risks to **2%**, but I think the loss of income for owners ***is worth a higher risk*** of problematic delays.")
 
+# Sub-section 5 : What-if - Which pair of thresholds gives the best trade-off?
+st.subheader("What-if: which pair of thresholds gives the best trade-off?")
+st.write("Every pair of thresholds for mobile and connect check-ins is evaluated below, with the percentage of problematic delays it solves and the percentage of rentals it would have blocked, as a proxy for the owners' revenue loss.")
+
+what_if_step = st.select_slider("Grid step (minutes)", options=[5, 10, 15, 30, 60], value=10)
+what_if_grid = cached_threshold_grid(threshold_analyzer, data_version, 1440, what_if_step)
+
+def build_what_if_heatmap():
+    fig = go.Figure(go.Heatmap(
+        z=what_if_grid['solved_share'],
+        x=what_if_grid['connect_thresholds'],
+        y=what_if_grid['mobile_thresholds'],
+        customdata=what_if_grid['blocked_share'],
+        colorscale='Viridis',
+        colorbar=dict(title='% solved'),
+        hovertemplate='Mobile: %{y} min<br>Connect: %{x} min<br>Solved: %{z:.2f}%<br>Blocked: %{customdata:.2f}%<extra></extra>',
+    ))
+    fig.update_layout(title='Percentage of Problematic Delays Solved by Pair of Thresholds',
+                      xaxis_title='Connect Threshold (minutes)', yaxis_title='Mobile Threshold (minutes)')
+    return fig
+
+st.plotly_chart(figure_cache.get_or_build(data_version, 'what_if_heatmap', (what_if_step,), build_what_if_heatmap))
+
+def build_pareto_figure():
+    frontier = what_if_grid['frontier']
+    fig = go.Figure(go.Scatter(
+        x=frontier['blocked_share'], y=frontier['solved_share'], mode='lines+markers', name='Best pairs',
+        customdata=frontier[['mobile_threshold', 'connect_threshold']].to_numpy(),
+        hovertemplate='Mobile: %{customdata[0]} min<br>Connect: %{customdata[1]} min<br>Blocked: %{x:.2f}%<br>Solved: %{y:.2f}%',
+    ))
+    # Place the two policies chosen above on the frontier
+    for name, mobile_threshold, connect_threshold in (('5% risk', threshold_mobile_5, threshold_connect_5),
+                                                      ('2% risk', threshold_mobile_2, threshold_connect_2)):
+        policy = threshold_grid(threshold_analyzer, [mobile_threshold], [connect_threshold])
+        fig.add_trace(go.Scatter(x=policy['blocked_share'][0], y=policy['solved_share'][0], mode='markers',
+                                 marker=dict(size=12), name=f'{name} ({mobile_threshold}/{connect_threshold} min)'))
+    fig.update_layout(title='Problematic Delays Solved against Rentals Blocked (Pareto Frontier)',
+                      xaxis_title='Percentage of Rentals Blocked', yaxis_title='Percentage of Problematic Delays Solved')
+    return fig
+
+st.plotly_chart(figure_cache.get_or_build(data_version, 'what_if_pareto', (what_if_step,), build_pareto_figure))
+
 # Sidebar
 st.sidebar.header("Getaround dashboard")
 st.sidebar.markdown("""
@@ -0,0 +1,69 @@
+"""
+Checks the rental chain against the merge-based computation on a small offline fixture.
+
+Run from the Dashboard directory:
+    python -m pytest -q test_rental_chain.py
+"""
+import numpy as np
+import pandas as pd
+import pytest
+from cleaning import clean_delay_data
+from rental_chain import NO_ROW, RentalChain, check_against_merge
+
+
+@pytest.fixture
+def delay_data():
+    """Eight rentals: two without a previous rental, two whose previous rental is not in the
+    dataset, and a linked rental whose previous checkout delay is unknown"""
+    return clean_delay_data(pd.DataFrame({
+        'rental_id': [1, 2, 3, 4, 5, 6, 7, 8],
+        'car_id': [10, 10, 10, 11, 12, 12, 10, 13],
+        'checkin_type': ['mobile', 'mobile', 'connect', 'mobile', 'connect', 'connect', 'mobile', 'mobile'],
+        'state': ['ended'] * 7 + ['canceled'],
+        'delay_at_checkout_in_minutes': [10, 45, np.nan, -5, 100, 20, 700, np.nan],
+        'previous_ended_rental_id': [np.nan, 1, 2, 99, np.nan, 5, 3, 100],
+        'time_delta_with_previous_rental_in_minutes': [np.nan, 30, 60, 120, np.nan, 0, 600, 30],
+    }))
+
+
+def test_chain_matches_merge(delay_data):
+    for seed in range(5):
+        assert check_against_merge(delay_data, n_batches=3, seed=seed) == {
+            "rentals": 8, "linked": 4, "problematic": 3,
+        }
+
+
+def test_chain_values(delay_data):
+    chain = RentalChain(delay_data)
+    np.testing.assert_array_equal(chain.previous_position, [NO_ROW, 0, 1, NO_ROW, NO_ROW, 4, 2, NO_ROW])
+    np.testing.assert_array_equal(chain.delta_previous_and_delay,
+                                  [np.nan, -15, np.nan, np.nan, np.nan, -20, -100, np.nan])
+    np.testing.assert_array_equal(chain.previous_delay, [np.nan, 10, 45, np.nan, np.nan, 100, np.nan, np.nan])
+    np.testing.assert_array_equal(chain.problematic(), [False, True, False, False, False, True, True, False])
+
+
+def test_out_of_order_batches(delay_data):
+    chain = RentalChain()
+    # Rentals arrive before their previous rental, which links them once it is appended
+    np.testing.assert_array_equal(chain.append(delay_data.iloc[[6, 5, 1]]), [])
+    # Rentals 3 and 5 link the pending rentals 7 and 6 (positions 0 and 1), and rental 3 links to rental 2
+    np.testing.assert_array_equal(np.sort(chain.append(delay_data.iloc[[2, 4]])), [0, 1, 3])
+    # Rental 1 links the pending rental 2, the previous rentals of rentals 4 and 8 never arrive
+    np.testing.assert_array_equal(np.sort(chain.append(delay_data.iloc[[0, 3, 7]])), [2])
+
+    expected = RentalChain(delay_data)
+    positions = chain.positions(expected.rental_id)
+    np.testing.assert_array_equal(chain.delta_previous_and_delay[positions], expected.delta_previous_and_delay)
+    np.testing.assert_array_equal(chain.previous_delay[positions], expected.previous_delay)
+    assert chain.linked.sum() == expected.linked.sum() == 4
+
+
+def test_unknown_ids(delay_data):
+    chain = RentalChain(delay_data)
+    np.testing.assert_array_equal(chain.positions([3, 99, NO_ROW]), [2, NO_ROW, NO_ROW])
+
+
+def test_duplicate_ids_rejected(delay_data):
+    chain = RentalChain(delay_data)
+    with pytest.raises(ValueError):
+        chain.append(delay_data.iloc[[0]])
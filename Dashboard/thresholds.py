@@ -0,0 +1,91 @@
+"""
+Threshold analysis on checkout delays sorted once per check-in type.
+
+With the delays sorted, the number of rentals later than a threshold, or of problematic delays
+that a threshold would solve, is a binary search (`np.searchsorted`) instead of a filter over
+the whole DataFrame, so any number of thresholds is answered in one vectorized call.
+"""
+import numpy as np
+import streamlit as st
+from cleaning import cached_clean_delay_data
+from data_loading import DATA_SOURCE, cached_source_version
+from rental_chain import cached_problematic_rentals
+
+DELAY_COLUMN = 'delay_at_checkout_in_minutes'
+TIME_DELTA_COLUMN = 'time_delta_with_previous_rental_in_minutes'
+
+
+def sorted_delays(data, column=DELAY_COLUMN):
+    """Sorted non-missing values of a column (the checkout delays by default), overall (key None) and per check-in type"""
+    delays = data[column].to_numpy(dtype=np.float64, na_value=np.nan)
+    checkin_types = data['checkin_type'].astype(str).to_numpy()
+    by_type = {None: np.sort(delays[~np.isnan(delays)])}
+    for checkin_type in np.unique(checkin_types):
+        type_delays = delays[checkin_types == checkin_type]
+        by_type[checkin_type] = np.sort(type_delays[~np.isnan(type_delays)])
+    return by_type
+
+
+def _percentage(counts, total):
+    if total == 0:
+        return np.full(len(counts), np.nan)
+    return counts * 100 / total
+
+
+class ThresholdAnalyzer:
+    """Share of late rentals, of solved problematic delays and of blocked rentals for any thresholds.
+
+    `delay_data` holds all the rentals and `problematic_delays` the rentals whose checkout was
+    later than the next check-in. The methods take a `checkin_type` ('mobile', 'connect',
+    or None for all the rentals) and a list or array of thresholds in minutes."""
+
+    def __init__(self, delay_data, problematic_delays):
+        self.delays = sorted_delays(delay_data)
+        self.problematic = sorted_delays(problematic_delays)
+        self.time_deltas = sorted_delays(delay_data, TIME_DELTA_COLUMN)
+        # Rentals with an unknown delay count in the totals, like in the original analysis
+        checkin_type_counts = delay_data['checkin_type'].astype(str).value_counts()
+        self.n_rentals = {None: len(delay_data), **checkin_type_counts.to_dict()}
+
+    def _delays(self, by_type, checkin_type):
+        return by_type.get(checkin_type, np.empty(0))
+
+    def count_above(self, thresholds, checkin_type=None):
+        """Number of rentals returned strictly later than each threshold"""
+        delays = self._delays(self.delays, checkin_type)
+        return len(delays) - np.searchsorted(delays, np.asarray(thresholds), side='right')
+
+    def share_above(self, thresholds, checkin_type=None):
+        """Percentage of the rentals returned strictly later than each threshold"""
+        return _percentage(self.count_above(thresholds, checkin_type), self.n_rentals.get(checkin_type, 0))
+
+    def solved_count(self, thresholds, checkin_type=None):
+        """Number of problematic delays shorter than or equal to each threshold"""
+        delays = self._delays(self.problematic, checkin_type)
+        return np.searchsorted(delays, np.asarray(thresholds), side='right')
+
+    def solved_share(self, thresholds, checkin_type=None):
+        """Percentage of the problematic delays shorter than or equal to each threshold"""
+        return _percentage(self.solved_count(thresholds, checkin_type),
+                           len(self._delays(self.problematic, checkin_type)))
+
+    def blocked_count(self, thresholds, checkin_type=None):
+        """Number of rentals booked less than each threshold after the previous rental of the car,
+        which a minimum delay of that threshold between two rentals would have prevented"""
+        time_deltas = self._delays(self.time_deltas, checkin_type)
+        return np.searchsorted(time_deltas, np.asarray(thresholds), side='left')
+
+    def blocked_share(self, thresholds, checkin_type=None):
+        """Percentage of the rentals that a minimum delay of each threshold would have prevented"""
+        return _percentage(self.blocked_count(thresholds, checkin_type), self.n_rentals.get(checkin_type, 0))
+
+
+@st.cache_resource(max_entries=2, show_spinner=False)
+def cached_threshold_analyzer(source, version):
+    return ThresholdAnalyzer(cached_clean_delay_data(source, version), cached_problematic_rentals(source, version))
+
+
+def get_threshold_analyzer(source=DATA_SOURCE):
+    """Threshold analyzer of the cleaned delay dataset, sorted once per version of the source
+    and shared across Streamlit reruns and sessions"""
+    return cached_threshold_analyzer(source, cached_source_version(source))
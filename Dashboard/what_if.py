@@ -0,0 +1,89 @@
+"""
+What-if grid over pairs of minimum delays for mobile and connect check-ins.
+
+For each (mobile threshold, connect threshold) pair, the share of problematic delays solved and
+the share of rentals that would have been blocked (a proxy for the owners' revenue loss) are the
+sums of two cumulative counts, one per check-in type, evaluated once per threshold with
+`np.searchsorted`. The grid is then an outer sum of these count vectors. Large grids are split
+by rows across a process pool.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+WHAT_IF_PROCESSES = int(os.environ.get('WHAT_IF_PROCESSES', os.cpu_count() or 1))
+# Grids with fewer cells are computed in the current process, faster than sending them to other processes
+WHAT_IF_PARALLEL_MIN_CELLS = int(os.environ.get('WHAT_IF_PARALLEL_MIN_CELLS', 20_000_000))
+
+
+def _grid_rows(solved_mobile, solved_connect, blocked_mobile, blocked_connect, n_problematic, n_rentals):
+    """Solved and blocked percentages for a block of mobile thresholds against all the connect thresholds"""
+    solved = (solved_mobile[:, None] + solved_connect[None, :]) * (100 / n_problematic)
+    blocked = (blocked_mobile[:, None] + blocked_connect[None, :]) * (100 / n_rentals)
+    return solved.astype(np.float32), blocked.astype(np.float32)
+
+
+def threshold_grid(analyzer, mobile_thresholds, connect_thresholds, processes=WHAT_IF_PROCESSES,
+                   parallel_min_cells=WHAT_IF_PARALLEL_MIN_CELLS):
+    """Share of problematic delays solved and of rentals blocked for every pair of thresholds,
+    as (len(mobile_thresholds), len(connect_thresholds)) arrays of percentages"""
+    mobile_thresholds = np.asarray(mobile_thresholds)
+    connect_thresholds = np.asarray(connect_thresholds)
+    solved_connect = analyzer.solved_count(connect_thresholds, 'connect')
+    blocked_connect = analyzer.blocked_count(connect_thresholds, 'connect')
+    solved_mobile = analyzer.solved_count(mobile_thresholds, 'mobile')
+    blocked_mobile = analyzer.blocked_count(mobile_thresholds, 'mobile')
+    n_problematic = max(len(analyzer.problematic[None]), 1)
+    n_rentals = max(analyzer.n_rentals[None], 1)
+
+    n_cells = len(mobile_thresholds) * len(connect_thresholds)
+    if processes > 1 and n_cells >= parallel_min_cells:
+        chunks = np.array_split(np.arange(len(mobile_thresholds)), processes)
+        with ProcessPoolExecutor(processes) as pool:
+            blocks = list(pool.map(
+                _grid_rows,
+                [solved_mobile[chunk] for chunk in chunks], [solved_connect] * len(chunks),
+                [blocked_mobile[chunk] for chunk in chunks], [blocked_connect] * len(chunks),
+                [n_problematic] * len(chunks), [n_rentals] * len(chunks),
+            ))
+        solved = np.vstack([block[0] for block in blocks])
+        blocked = np.vstack([block[1] for block in blocks])
+    else:
+        solved, blocked = _grid_rows(solved_mobile, solved_connect, blocked_mobile, blocked_connect,
+                                     n_problematic, n_rentals)
+
+    return {
+        "mobile_thresholds": mobile_thresholds,
+        "connect_thresholds": connect_thresholds,
+        "solved_share": solved,
+        "blocked_share": blocked,
+    }
+
+
+def pareto_frontier(grid):
+    """Pairs of thresholds for which no other pair solves more problematic delays while blocking
+    as many rentals or fewer, by increasing share of blocked rentals"""
+    solved = grid["solved_share"].ravel()
+    blocked = grid["blocked_share"].ravel()
+    # By increasing blocked share, and by decreasing solved share for equal blocked shares
+    order = np.lexsort((-solved, blocked))
+    best_solved = np.maximum.accumulate(solved[order])
+    on_frontier = order[np.r_[True, best_solved[1:] > best_solved[:-1]]]
+    mobile_index, connect_index = np.unravel_index(on_frontier, grid["solved_share"].shape)
+    return pd.DataFrame({
+        "mobile_threshold": grid["mobile_thresholds"][mobile_index],
+        "connect_threshold": grid["connect_thresholds"][connect_index],
+        "blocked_share": blocked[on_frontier],
+        "solved_share": solved[on_frontier],
+    })
+
+
+@st.cache_data(max_entries=8, show_spinner="Computing the what-if grid...")
+def cached_threshold_grid(_analyzer, data_version, max_threshold, step):
+    """Grid of thresholds from 0 to `max_threshold` minutes every `step` minutes, for both check-in types"""
+    thresholds = np.arange(0, max_threshold + 1, step)
+    grid = threshold_grid(_analyzer, thresholds, thresholds)
+    grid["frontier"] = pareto_frontier(grid)
+    return grid